@@ -0,0 +1,114 @@
+"""
+Copyright (c) 2016 Glen Rice and Chen Zhang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+This script catches water column data like MACNoiseViewer and runs the same
+processing, but instead of plotting it writes a summary of each ping to a
+file.  Nothing here loads pyplot, so it suits unattended logging machines.
+
+usage: python MACNoiseMonitor.py outfile [port]
+
+If outfile ends in .csv each ping is a line of
+    time, ping, serial, beams, minrange, noise, nadir, highpass_std,
+    followed by the average by beam for every beam
+Otherwise each ping is written as a little-endian binary record of
+    struct '<dHHHHfff' for the same fields, then beams float32 averages.
+time is the POSIX time the ping was finished, noise and nadir are the power
+averages (in dB) of the average by beam and the nadir beam, and
+highpass_std is the standard deviation of the along track high passed
+water column.
+"""
+import signal
+import sys
+import time
+import struct
+import Queue
+import numpy as np
+import km_io
+import packet_handler as ph
+
+record_fmt = '<dHHHHfff'
+
+def db_mean(values):
+    # power average in dB, ignoring NaN
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan
+    return 10 * np.log10((10**(values / 10.)).mean())
+
+def write_ping(outfile, ping, highpass, csv):
+    valid = highpass[~np.isnan(highpass)]
+    if len(valid) > 0:
+        highpass_std = valid.std()
+    else:
+        highpass_std = np.nan
+    fields = (time.time(), ping.ping, ping.header['SystemSerial#'], ping.beams,
+        ping.minrange, db_mean(ping.ave_by_beam), db_mean(ping.nadir_beam),
+        highpass_std)
+    if csv:
+        line = '%.3f,%d,%d,%d,%d,%.2f,%.2f,%.2f,' % fields
+        outfile.write(line + ','.join(['%.2f' % a for a in ping.ave_by_beam]) + '\n')
+    else:
+        outfile.write(struct.pack(record_fmt, *fields))
+        outfile.write(ping.ave_by_beam.astype('<f4').tostring())
+
+def signal_handler(signal, frame):
+    print ", You pressed Ctrl+C!"
+    monitor.stop_listen()
+    outfile.close()
+    sys.exit(0)
+
+if len(sys.argv) < 2:
+    print 'usage: python MACNoiseMonitor.py outfile [port]'
+    sys.exit(1)
+outfilename = sys.argv[1]
+port = 55709
+if len(sys.argv) > 2:
+    port = int(sys.argv[2])
+csv = outfilename.lower().endswith('.csv')
+if csv:
+    outfile = open(outfilename, 'a')
+else:
+    outfile = open(outfilename, 'ab')
+
+signal.signal(signal.SIGINT, signal_handler)
+
+monitor = km_io.km_io(port, [107], 1.0)
+monitor.start_listen()
+
+print 'catching data on port %d, writing to %s' % (port, outfilename)
+
+wc_filter = None
+last_flush = time.time()
+while True:
+    # the timeout only keeps Ctrl+C working
+    try:
+        ping = monitor.completed_pings.get(timeout = 1.0)
+    except Queue.Empty:
+        continue
+    if wc_filter is None or wc_filter.wc_buff.shape[2] != ping.beams:
+        wc_filter = ph.along_track_filter(ping.beams)
+    highpass = wc_filter.add(ping.data_array)
+    write_ping(outfile, ping, highpass, csv)
+    # the ping arrays go back to the pool for the next pings
+    ping.release()
+    if time.time() - last_flush > 1:
+        outfile.flush()
+        last_flush = time.time()
@@ -26,6 +26,7 @@ import time
 import km_io
 import packet_handler as ph
 import threading
+import Queue
 
 def signal_handler(signal, frame):
     print ", You pressed Ctrl+C!"
@@ -47,30 +48,35 @@ indicator = ['-','\\','|','/']
 
 print 'catching data:  ',
 
-have_num_beams = False
-while have_num_beams == False:
-    time.sleep(1)
-    if viewer.__dict__.has_key('holder'):
-        if viewer.holder.data_ready:
-            pWC = ph.PlotWCNoise(viewer.holder.beams, viewer.holder.minrange)
-            have_num_beams = True     
+pWC = None
 
-def wLoop():            
+def next_ping():
+    # Block until km_io has a finished ping.  The timeout keeps Ctrl+C
+    # working, since a wait without one can not be interrupted, and lets the
+    # plots show a ping that was held back by the frame rate limit.
+    while True:
+        try:
+            return viewer.completed_pings.get(timeout = 0.1)
+        except Queue.Empty:
+            if pWC is not None:
+                pWC.draw(force = True)
+
+# the first ping sets up the plots
+ping = next_ping()
+pWC = ph.PlotWCNoise(ping.beams, ping.minrange)
+
+def wLoop(ping):
     n = 0
     while True:
-        if viewer.holder.data_ready:
-            pWC.new_data(viewer.holder.ave_by_beam, viewer.holder.nadir_beam,
-                viewer.holder.data_array)
-            viewer.holder.data_ready = False
+        pWC.new_data(ping.ave_by_beam, ping.nadir_beam, ping.data_array)
+        # the ping arrays go back to the pool for the next pings
+        ping.release()
         if n > 3:
             n = 0
         print '\b\b' + indicator[n],
         n += 1
-        
-        #time.sleep(0.1)
+        ping = next_ping()
 
       
 #threading.Thread(target=wLoop()).start()
-wLoop()
-
-    
\ No newline at end of file
+wLoop(ping)
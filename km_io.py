@@ -24,6 +24,9 @@ import threading
 import struct
 import operator
 import time
+import bisect
+import Queue
+import collections
 import datetime as dt
 
 import udp_io
@@ -71,6 +74,136 @@ class km_io(udp_io.udp_io):
             110 : 'Network Attitude Velocity'
         }
 
+        # Watercolumn pings being put together, keyed by (serial, ping) and
+        # kept in order of their last update.  Pings are thrown away after
+        # ping_timeout seconds without a new datagram or when more than
+        # max_pings_in_flight are open.  Finished pings go on completed_pings.
+        # The keys of the last ping_window finished or thrown away pings are
+        # kept so datagrams arriving for them afterwards are known to be late.
+        self.pings_in_flight = collections.OrderedDict()
+        self._done_pings = collections.OrderedDict()
+        self.ping_window = 256
+        self.max_pings_in_flight = 8
+        self.ping_timeout = 2.0
+        self.completed_pings = Queue.Queue(64)
+        # samples in the last finished ping, used to size the next one
+        self._wc_samples = 0
+        # keep pings as int8 raw amplitudes (see packet_handler)
+        self.wc_raw = False
+
+        # Receiver statistics, see stats().  A stats line is printed every
+        # stats_interval seconds if it is greater than zero.  Parse times are
+        # counted in the bins with upper edges latency_bins (seconds).
+        self.stats_interval = 0
+        self.latency_bins = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5]
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Zeros all of the receiver statistics.
+        """
+        self.stats_start = time.time()
+        self.dg_counts = {}
+        self.dg_bytes = {}
+        self.total_bytes = 0
+        self.pings = 0
+        self.missed_pings = 0
+        self.late_datagrams = 0
+        self.missed_datagrams = 0
+        self.latency_counts = [0] * (len(self.latency_bins) + 1)
+        self.evicted_pings = 0
+        self.dropped_pings = 0
+        self._wc_pings = {}
+        self._last_stats = (self.stats_start, 0, 0)
+
+    def stats(self):
+        """
+        Returns a dictionary snapshot of the receiver statistics.  Pings missed
+        are PingCounters up to the newest that have not been seen (a ping that
+        shows up out of order stops being missed), datagrams missed are those
+        of the #OfDatagrams in a finished or thrown away watercolumn ping that
+        never showed up, and late datagrams are for a ping already finished or
+        thrown away.  The queue depths and drops from the listen thread are included so losses
+        can be put on the network or on this machine.
+        """
+        elapsed = time.time() - self.stats_start
+        if elapsed > 0:
+            rate = self.total_bytes / elapsed
+        else:
+            rate = 0.
+        return {'elapsed' : elapsed,
+            'counts' : dict(self.dg_counts),
+            'bytes' : dict(self.dg_bytes),
+            'total_bytes' : self.total_bytes,
+            'bytes_per_sec' : rate,
+            'pings' : self.pings,
+            'missed_pings' : self.missed_pings,
+            'missed_datagrams' : self.missed_datagrams,
+            'late_datagrams' : self.late_datagrams,
+            'evicted_pings' : self.evicted_pings,
+            'dropped_pings' : self.dropped_pings,
+            'latency_bins' : list(self.latency_bins),
+            'latency_counts' : list(self.latency_counts),
+            'queue_depth' : self.queue_depth(),
+            'queue_dropped' : dict(self.dropped),
+            }
+
+    def stats_line(self):
+        """
+        Returns a one line summary of the statistics since the last time this
+        method was called.
+        """
+        now = time.time()
+        last_time, last_bytes, last_count = self._last_stats
+        count = sum(self.dg_counts.values())
+        dt_stats = now - last_time
+        if dt_stats <= 0:
+            dt_stats = 1.
+        self._last_stats = (now, self.total_bytes, count)
+        return "%s: %.0f datagrams/s, %.0f bytes/s, %d pings, %d missed " \
+            "pings, %d missed datagrams, %d late datagrams, queues %s, " \
+            "dropped %s" % (dt.datetime.utcnow(),
+            (count - last_count) / dt_stats,
+            (self.total_bytes - last_bytes) / dt_stats, self.pings,
+            self.missed_pings, self.missed_datagrams, self.late_datagrams,
+            self.queue_depth(), self.dropped)
+
+    def _count_wc(self, this_data):
+        """
+        Keeps track of the watercolumn PingCounters seen for each system
+        serial number.  Pings from the first one seen (or the start of the
+        last ping_window pings) to the newest one that have not been seen are
+        counted as missed, so a ping that shows up out of order stops being
+        missed.  Pings more than ping_window older than the newest are not
+        counted.
+        """
+        ping, serial = struct.unpack('<HH', this_data[12:16])
+        if not self._wc_pings.has_key(serial):
+            self.pings += 1
+            self._wc_pings[serial] = [ping, ping, set([ping])]
+            return
+        first, newest, seen = self._wc_pings[serial]
+        if ping in seen:
+            return
+        diff = (ping - newest) % 65536
+        if diff < 32768:
+            self.missed_pings += diff - 1
+            newest = ping
+            seen = set([p for p in seen if (newest - p) % 65536 < self.ping_window])
+            if (newest - first) % 65536 >= self.ping_window:
+                first = (newest - self.ping_window + 1) % 65536
+        elif 65536 - diff < self.ping_window:
+            if (ping - first) % 65536 <= (newest - first) % 65536:
+                self.missed_pings -= 1
+            else:
+                self.missed_pings += (first - ping) % 65536 - 1
+                first = ping
+        else:
+            return
+        self._wc_pings[serial] = [first, newest, seen]
+        seen.add(ping)
+        self.pings += 1
+
     def request_IUR(self, remote_ip):
         sock_out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # I don't want to force people to configure software for sensor type
@@ -104,9 +237,24 @@ class km_io(udp_io.udp_io):
         if len(self.desired_datagrams) == 0:
             #print "not going to parse!"
             return
+        start = time.time()
         this_data = self.data[:]
         
         self.id = struct.unpack("<BB",this_data[0:2])[1]
+        self.dg_counts[self.id] = self.dg_counts.get(self.id, 0) + 1
+        self.dg_bytes[self.id] = self.dg_bytes.get(self.id, 0) + len(this_data)
+        self.total_bytes += len(this_data)
+        if self.id == 0x6b and len(this_data) >= 20:
+            self._count_wc(this_data)
+
+        self.parse_datagram(this_data)
+
+        now = time.time()
+        self.latency_counts[bisect.bisect_left(self.latency_bins, now - start)] += 1
+        if self.stats_interval > 0 and now - self._last_stats[0] >= self.stats_interval:
+            print self.stats_line()
+
+    def parse_datagram(self, this_data):
 
         try:
             name = self.dg_names[self.id]
@@ -114,7 +262,9 @@ class km_io(udp_io.udp_io):
             name = "Unknown name"
 
         if self.debug:
-            print "%s ... %s: Datagram ID %d/0x%x/%c, size: %d, type %s" % ( dt.datetime.utcnow(), self.sender, self.id, self.id, self.id, len(this_data), name )
+            print "%s ... %s: Datagram ID %d/0x%x/%c, size: %d, type %s" % \
+                ( dt.datetime.utcnow(), self.sender, self.id, self.id,
+                self.id, len(this_data), name )
 
         if self.id not in self.desired_datagrams:
             if self.debug:
@@ -162,16 +312,7 @@ class km_io(udp_io.udp_io):
             # if self.debug:
                 # print self.seabed_image89
         if self.id == 0x6b:
-            ping, = struct.unpack('<H', this_data[12:14])
-            if not self.__dict__.has_key('holder'):
-                self.holder = ph.packet_handler(this_data[12:])
-            elif self.holder.ping == ping:
-                self.holder.new_data(this_data[12:])
-            else:
-                self.old_holder = self.holder
-                self.holder = ph.packet_handler(this_data[12:])
-            if self.debug:
-                print self.holder.ping
+            self.assemble_ping(this_data[12:])
         # else:
             # if self.debug:
                 # print "Cannot parse datagram of ID", self.id
@@ -179,6 +320,78 @@ class km_io(udp_io.udp_io):
 
         # return
 
+    def assemble_ping(self, wc):
+        """
+        Adds a watercolumn datagram to the ping it belongs to.  Datagrams for
+        several pings can arrive interleaved or out of order.  Pings that are
+        finished are passed to finish_ping.  Open pings that have timed out or
+        are past max_pings_in_flight are thrown away, least recently updated
+        first.
+        """
+        ping, serial = struct.unpack('<HH', wc[:4])
+        key = (serial, ping)
+        now = time.time()
+        if self.pings_in_flight.has_key(key):
+            handler = self.pings_in_flight.pop(key)[0]
+            handler.new_data(wc)
+        elif self._done_pings.has_key(key):
+            self.late_datagrams += 1
+            return
+        else:
+            handler = ph.packet_handler(wc, samples = self._wc_samples, raw = self.wc_raw)
+        if handler.data_ready:
+            self._done_ping(key, handler)
+            self.finish_ping(handler)
+        else:
+            self.pings_in_flight[key] = (handler, now)
+        while len(self.pings_in_flight) > 0:
+            oldest = next(iter(self.pings_in_flight))
+            last = self.pings_in_flight[oldest][1]
+            if len(self.pings_in_flight) > self.max_pings_in_flight or \
+                    now - last > self.ping_timeout:
+                handler = self.pings_in_flight.pop(oldest)[0]
+                self._done_ping(oldest, handler)
+                handler.release()
+                self.evicted_pings += 1
+                if self.debug:
+                    print "Gave up on ping %d from system %d" % (oldest[1], oldest[0])
+            else:
+                break
+
+    def _done_ping(self, key, handler):
+        """
+        Counts the datagrams the ping never got and remembers the ping so
+        datagrams for it that arrive later are counted as late.
+        """
+        self.missed_datagrams += handler.total_number - handler.numpackets
+        self._done_pings[key] = True
+        while len(self._done_pings) > self.ping_window:
+            self._done_pings.popitem(last = False)
+
+    def finish_ping(self, handler):
+        """
+        Makes the finished ping the holder and puts it on the completed_pings
+        queue, dropping (and releasing) the oldest waiting ping if the queue is
+        full.  Once the ping is released by whoever takes it off the queue the
+        holder no longer has its arrays.
+        """
+        if self.__dict__.has_key('holder'):
+            self.old_holder = self.holder
+        self.holder = handler
+        self._wc_samples = handler.maxsamples
+        while True:
+            try:
+                self.completed_pings.put_nowait(handler)
+                break
+            except Queue.Full:
+                try:
+                    self.completed_pings.get_nowait().release()
+                    self.dropped_pings += 1
+                except Queue.Empty:
+                    pass
+        if self.debug:
+            print handler.ping
+
     def log_to_file(self, data):
         # This is currently writes data in a Kongsberg .all format.
         # This involves writing the length of each datagram as a 4-byte
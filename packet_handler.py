@@ -29,67 +29,136 @@ assembles them for other uses.
 
 """
 
+import threading
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 import par
 
-plt.ion()
+# pyplot is only loaded once PlotWCNoise is used
+plt = par.plt
+
+
+class buffer_pool:
+    """
+    A pool of ping arrays (float32, or int8 for raw pings) so that pings can
+    be put together without allocating new arrays once things are running.
+    Up to depth free arrays are kept.  Arrays are handed out with at least the rows asked for, and a
+    new, bigger array is made when none of the free ones is big enough.  This
+    is used from both the listen and display threads, so it is locked.
+    """
+    def __init__(self, depth = 8):
+        self.depth = depth
+        self.allocated = 0
+        self._free = []
+        self._lock = threading.Lock()
+
+    def checkout(self, rows, cols, dtype = np.float32):
+        """
+        Returns an array of dtype with cols columns and at least rows rows.
+        """
+        with self._lock:
+            for n, buf in enumerate(self._free):
+                if buf.dtype == dtype and buf.shape[1] == cols and buf.shape[0] >= rows:
+                    return self._free.pop(n)
+            # nothing fits, so make room for the new array by dropping the
+            # smallest free one if the pool is full
+            if len(self._free) >= self.depth and len(self._free) > 0:
+                sizes = [buf.size for buf in self._free]
+                self._free.pop(sizes.index(min(sizes)))
+            self.allocated += 1
+        return np.empty((rows, cols), dtype = dtype)
+
+    def checkin(self, buf):
+        """
+        Gives an array back to the pool.  Nothing should use it after this.
+        """
+        with self._lock:
+            if len(self._free) < self.depth:
+                self._free.append(buf)
+
+    def resize(self, depth):
+        """
+        Changes the number of free arrays kept.
+        """
+        with self._lock:
+            self.depth = depth
+            del self._free[depth:]
+
+
+# the pool used by packet_handler unless it is given another one
+ping_pool = buffer_pool()
 
 
 class packet_handler:
     """
     hold
     """
-    def __init__(self, wc, absorption = 0.030):
+    def __init__(self, wc, absorption = 0.030, samples = 0, pool = None, raw = False):
         """
         hold
         """
         self.data_ready = False
         self.absorption = absorption
+        # with raw set the ping is kept as the int8 raw amplitudes in
+        # raw_array, and data_array is made from it when it is used
+        self.raw = raw
+        if pool is None:
+            pool = ping_pool
+        self.pool = pool
+        self._out = None
         data = par.Data107(wc)
+        self.header = data.header
         self.ping = data.header['PingCounter']
         self.total_number = data.header['#OfDatagrams']
         self.beams = data.header['Total#Beams']
-        this_beams = data.header['NumberBeamsInDatagram']
-        # set the beam angle array pointer
-        self._beams_so_far = this_beams
         # set the maximum number of samples tracker
-        self.maxsamples = len(data.ampdata)
+        self.maxsamples = len(data.rawamp)
         # set the minimum range tracker
         detection_range = data.rx['DetectedRange']
         idx = np.nonzero(detection_range != 0)[0]
         if len(idx) > 0:
             self.minrange = detection_range[idx].min()
         else:
-            self.minrange = len(data.ampdata)
-        # get the water column magnitude data
-        self.ampdata = []
-        data.deTVG(self.absorption,0)
-        self.ampdata.append(data.ampdata)
-        # store the beam pointing angles
+            self.minrange = len(data.rawamp)
+        # the ping is put together in one float32 (or int8) array with a
+        # column per beam, filled in the order the datagrams arrive.  There
+        # are rows for at least samples (an estimate from earlier pings) and
+        # it grows if a datagram has more.  The columns and beam pointing angles are kept by
+        # datagram number since datagrams may arrive out of order.  The array
+        # comes from the pool and is given back once the ping is assembled.
+        if self.raw:
+            dtype = np.int8
+        else:
+            dtype = np.float32
+        self._buffer = self.pool.checkout(max(samples, self.maxsamples), self.beams, dtype)
+        self._next_column = 0
+        self._columns = {}
+        self.rx_angles = {}
+        self.rx_samples = {}
+        if not self.raw:
+            data.deTVG(self.absorption,0)
+        self._add(data)
         self.beam_angles = np.zeros(self.beams)
-        self.beam_angles[:this_beams] = data.rx['BeamPointingAngle'][:]
         self.numpackets = 1
         if self.numpackets == self.total_number:
-            self.process_data(data.ampdata)               
+            # a ping in one datagram is put in beam angle order like any other
+            self.process_data(self.assemble())
         
     def new_data(self, wc):
         """
         hold
         """
         data = par.Data107(wc)
-        # get the number of beams
-        this_beams = data.header['NumberBeamsInDatagram']
-        # get the beam pointing angles and add to the array
-        self.beam_angles[self._beams_so_far:self._beams_so_far+this_beams] = data.rx['BeamPointingAngle'][:]
-        # increment the pointer
-        self._beams_so_far += this_beams
-        # get the water column magnitude data
-        data.deTVG(self.absorption,0)
-        self.ampdata.append(data.ampdata)
+        if self._columns.has_key(data.header['Datagram#']):
+            # a repeat of a datagram already in hand
+            return
+        # get the water column magnitude data and beam pointing angles
+        if not self.raw:
+            data.deTVG(self.absorption,0)
+        self._add(data)
         # track the maximum number of samples
-        if len(data.ampdata) > self.maxsamples:
-            self.maxsamples = len(data.ampdata)
+        if len(data.rawamp) > self.maxsamples:
+            self.maxsamples = len(data.rawamp)
         # track the minimum range to detection
         detection_range = data.rx['DetectedRange']
         idx = np.nonzero(detection_range != 0)[0]
@@ -101,40 +170,152 @@ class packet_handler:
         if self.numpackets == self.total_number:
             data_array = self.assemble()
             self.process_data(data_array)
+
+    def _add(self, data):
+        """
+        Copies the datagram samples into the next free columns of the ping
+        array, with NaN (or Data107.missing if raw) below the last sample.
+        """
+        if self.raw:
+            amp = data.rawamp
+        else:
+            amp = data.ampdata
+        numsamples, numbeams = amp.shape
+        if numsamples > self._buffer.shape[0]:
+            self._grow(numsamples)
+        col = self._next_column
+        self._buffer[:numsamples, col:col+numbeams] = amp
+        self._buffer[numsamples:, col:col+numbeams] = self._fill()
+        self._columns[data.header['Datagram#']] = (col, numbeams)
+        self.rx_angles[data.header['Datagram#']] = data.rx['BeamPointingAngle']
+        self.rx_samples[data.header['Datagram#']] = data.rx['NumberSamples']
+        self._next_column += numbeams
+
+    def _fill(self):
+        """
+        The value for places in the ping array without samples.
+        """
+        if self.raw:
+            return par.Data107.missing
+        else:
+            return np.nan
+
+    def _grow(self, numsamples):
+        """
+        Makes room for at least numsamples rows in the ping array, growing by
+        at least a quarter to keep the number of copies down.
+        """
+        old = self._buffer
+        rows = max(numsamples, int(1.25 * old.shape[0]))
+        self._buffer = self.pool.checkout(rows, self.beams, old.dtype)
+        self._buffer[:old.shape[0]] = old
+        self._buffer[old.shape[0]:] = self._fill()
+        self.pool.checkin(old)
             
     def assemble(self):
         """
         hold
         """
-        data_array = np.zeros((self.maxsamples, self.beams))
-        data_array[:,:] = np.nan
+        # beam angles and samples in datagram order, and the array column
+        # for each
+        cols = np.zeros(self.beams, dtype = np.intp)
+        beam_samples = np.zeros(self.beams, dtype = np.intp)
         beam_pointer = 0
-        for n in self.ampdata:
-            dim = n.shape
-            data_array[:dim[0], beam_pointer:beam_pointer+dim[1]] = n[:,:]
-            beam_pointer += dim[1]
+        for dgnum in sorted(self._columns):
+            col, numbeams = self._columns[dgnum]
+            self.beam_angles[beam_pointer:beam_pointer+numbeams] = self.rx_angles[dgnum]
+            beam_samples[beam_pointer:beam_pointer+numbeams] = self.rx_samples[dgnum]
+            cols[beam_pointer:beam_pointer+numbeams] = np.arange(col, col+numbeams)
+            beam_pointer += numbeams
+        # beams that never showed up
+        self._buffer[:, self._next_column:] = self._fill()
+        cols[beam_pointer:] = np.arange(self._next_column, self.beams)
         idx = self.beam_angles.argsort()
-        data_array[:,:] = data_array[:,idx]
+        self.beam_samples = beam_samples[idx]
+        # gather the sorted columns into an array from the pool
+        self._out = self.pool.checkout(self.maxsamples, self.beams, self._buffer.dtype)
+        data_array = self._out[:self.maxsamples]
+        np.take(self._buffer[:self.maxsamples], cols[idx], axis = 1, out = data_array)
+        self.pool.checkin(self._buffer)
+        self._buffer = None
         return data_array
+
+    def release(self):
+        """
+        Gives the arrays of this ping back to the pool.  Call this once done
+        with data_array, raw_array and nadir_beam (after PlotWCNoise.new_data)
+        so the next pings can reuse them.  Those attributes are removed since
+        the arrays behind them will be filled with later pings.
+        """
+        if self._buffer is not None:
+            self.pool.checkin(self._buffer)
+            self._buffer = None
+        if self._out is not None:
+            self.pool.checkin(self._out)
+            self._out = None
+            for name in ('data_array', 'raw_array', 'nadir_beam'):
+                if self.__dict__.has_key(name):
+                    del self.__dict__[name]
         
     def process_data(self,data_array):
         """
         hold
         """
-        self.data_array = data_array
-        self.ave_by_beam = data_array[:self.minrange - 10, :].mean(axis = 0)
-        self.nadir_beam = data_array[:,int(self.beams/2)]
+        if self.raw:
+            self.raw_array = data_array
+            self._tvg = par.Data107.tvg_curve(self.header, self.absorption, 0, self.maxsamples)
+            ave = self.getdb(rows = slice(None, self.minrange - 10))
+            self.nadir_beam = self.getdb(cols = int(self.beams/2))
+        else:
+            self.data_array = data_array
+            ave = data_array[:self.minrange - 10, :]
+            self.nadir_beam = data_array[:,int(self.beams/2)]
+        self.ave_by_beam = ave.mean(axis = 0, dtype = np.float64)
         self.data_ready = True
+
+    def __getattr__(self, name):
+        """
+        Makes data_array from raw_array the first time it is asked for.
+        """
+        if name == 'data_array' and self.__dict__.has_key('raw_array'):
+            self.data_array = self.getdb()
+            return self.data_array
+        raise AttributeError(name)
+
+    def getdb(self, rows = slice(None), cols = slice(None)):
+        """
+        Returns the rows and columns of the raw ping in dB with the TVG
+        removed and NaN where the beams have no samples, as float32.
+        """
+        db = self.raw_array[rows, cols].astype(np.float32)
+        db *= 0.5
+        samplenum = np.arange(self.maxsamples)[rows]
+        if np.ndim(db) == 1:
+            db[samplenum >= self.beam_samples[cols]] = np.nan
+            db -= self._tvg[rows, 0]
+        else:
+            db[samplenum[:,np.newaxis] >= self.beam_samples[cols]] = np.nan
+            db -= self._tvg[rows]
+        return db
  
  
 class PlotWCNoise():
 
-    def __init__(self, beams, samples, low_pass_len = 10):
+    def __init__(self, beams, samples, low_pass_len = 10, history = 63, max_samples = 4000,
+        max_fps = 10, clim_threshold = 0.1, blit = True):
         fig = plt.figure(figsize = (12,8))
+        self.fig = fig
+        # The scrolling plots show the last history pings, newest first.  They
+        # are kept in rings twice as wide that get each ping written in both
+        # halves, so the history is always one slice and a new ping costs
+        # only its own column.
+        self._history = history
+        self._hist_pntr = 0
         # initialize the average by beam subplot
         ax = fig.add_subplot(221)
-        self.ave_buff = np.zeros((beams, 63))
-        self.ave_buff[:,:] = np.nan
+        self.ave_ring = np.zeros((beams, 2 * history))
+        self.ave_ring[:,:] = np.nan
+        self.ave_buff = self.ave_ring[:, :history]
         self.ave_im = ax.imshow(self.ave_buff, aspect = 'auto', interpolation = 'none')
         self.cabar = plt.colorbar(mappable = self.ave_im)
         self.cabar.set_label('dB re $1\mu Pa$ at 1 meter')
@@ -143,8 +324,9 @@ class PlotWCNoise():
         self.ca = color_range_tracker(multiplier = 3)
         # initialize the nadir beam scrolling plot
         ax2 = fig.add_subplot(223)
-        self.nadir_buff = np.zeros((samples, 63))
-        self.nadir_buff[:,:] = np.nan
+        self.nadir_ring = np.zeros((samples, 2 * history))
+        self.nadir_ring[:,:] = np.nan
+        self.nadir_buff = self.nadir_ring[:, :history]
         self.nadir_im = ax2.imshow(self.nadir_buff, aspect = 'auto', interpolation = 'none')
         self.cnbar = plt.colorbar(mappable = self.nadir_im)
         self.cnbar.set_label('dB re $1\mu Pa$ at 1 meter')
@@ -152,12 +334,8 @@ class PlotWCNoise():
         self.cn = color_range_tracker()
         # initialize the along track filtered water column display
         ax3 = fig.add_subplot(122)
-        self._wc_ave_pntr = 0
-        self._total_wc_ave = low_pass_len
-        # guessing at a max range
-        self.wc_buff = np.zeros((4000, beams, self._total_wc_ave))
-        self.wc_buff[:,:,:] = np.nan
-        self.wc_im = ax3.imshow(self.wc_buff[:,:,0], aspect = 'auto', interpolation = 'none')
+        self.wc_filter = along_track_filter(beams, low_pass_len, max_samples)
+        self.wc_im = ax3.imshow(self.wc_filter.wc_buff[0], aspect = 'auto', interpolation = 'none')
         self.cwbar = plt.colorbar(mappable = self.wc_im)
         self.cwbar.set_label('dB re $1\mu Pa$ at 1 meter')
         ax3.set_yticklabels([])
@@ -165,60 +343,260 @@ class PlotWCNoise():
         ax3.set_xlabel('Beam Number')
         ax3.set_title('High Pass Water column')
         self.cwc = color_range_tracker(multiplier = 3)
+        # Drawing is held to max_fps, showing the latest ping, and only the
+        # three images are redrawn (blitted over saved backgrounds) unless a
+        # color limit moves by more than clim_threshold of its range, which
+        # needs the color bars redrawn too.
+        self._plots = [(ax, self.ave_im), (ax2, self.nadir_im), (ax3, self.wc_im)]
+        if max_fps > 0:
+            self._frame_time = 1. / max_fps
+        else:
+            self._frame_time = 0
+        self._last_frame = 0
+        self._pending = False
+        self._clim_threshold = clim_threshold
+        self._full_draw = True
+        self._backgrounds = None
+        self._blit = blit and getattr(fig.canvas, 'supports_blit', False)
+        if self._blit:
+            for ax, im in self._plots:
+                im.set_animated(True)
+            fig.canvas.mpl_connect('draw_event', self._save_backgrounds)
         
     def new_data(self, ave_by_beam, nadir_beam, data_array):
+        # step the scrolling plots back one ping
+        self._hist_pntr = (self._hist_pntr - 1) % self._history
         #update average by beam
-        self.ave_buff[:,1:] = self.ave_buff[:,:-1]
-        self.ave_buff[:,0] = ave_by_beam[:]
+        self.ave_buff = self._scroll(self.ave_ring, ave_by_beam[:])
         self.ave_im.set_data(self.ave_buff)
         self.ca.add(ave_by_beam)
-        self.ave_im.set_clim(self.ca.minmax())
+        self._set_clim(self.ave_im, self.ca.minmax())
         #update nadir beam plot
-        self.nadir_buff[:,1:] = self.nadir_buff[:,:-1]
-        self.nadir_buff[:,0] = nadir_beam[:self.nadir_buff.shape[0]]
+        self.nadir_buff = self._scroll(self.nadir_ring, nadir_beam[:self.nadir_ring.shape[0]])
         self.nadir_im.set_data(self.nadir_buff)
         self.cn.add(nadir_beam)
-        self.nadir_im.set_clim(self.cn.minmax())
+        self._set_clim(self.nadir_im, self.cn.minmax())
         #update water column
         wc_mean = self.ave_wc(data_array)
         self.wc_im.set_data(wc_mean)
         self.cwc.add(wc_mean)
-        self.wc_im.set_clim(self.cwc.minmax())
+        self._set_clim(self.wc_im, self.cwc.minmax())
         # draw all the plots
-        plt.pause(0.001)
+        self._pending = True
+        self.draw()
+
+    def draw(self, force = False):
+        """
+        Draws the latest ping if it has not been drawn and the last frame was
+        at least 1/max_fps ago, or regardless of the time if force is True.
+        Call this when no pings are coming so the last one gets shown.
+        """
+        now = time.time()
+        if not self._pending or (not force and now - self._last_frame < self._frame_time):
+            return
+        self._last_frame = now
+        self._pending = False
+        if not self._blit:
+            plt.pause(0.001)
+            return
+        canvas = self.fig.canvas
+        if self._full_draw or self._backgrounds is None:
+            # the backgrounds get saved by the draw event
+            self._full_draw = False
+            canvas.draw()
+        for (ax, im), background in zip(self._plots, self._backgrounds):
+            canvas.restore_region(background)
+            ax.draw_artist(im)
+            canvas.blit(ax.bbox)
+        canvas.flush_events()
+
+    def _save_backgrounds(self, event):
+        """
+        Keeps the plots without the images after every full draw (including
+        resizes) to blit the images over.
+        """
+        self._backgrounds = [self.fig.canvas.copy_from_bbox(ax.bbox) for ax, im in self._plots]
+
+    def _set_clim(self, im, clim):
+        """
+        Sets the color limits only if they moved more than clim_threshold of
+        the current range, or always when not blitting.
+        """
+        if not self._blit:
+            im.set_clim(clim)
+            return
+        old = im.get_clim()
+        span = abs(old[1] - old[0])
+        change = max(abs(clim[0] - old[0]), abs(clim[1] - old[1]))
+        if not span > 0 or change > self._clim_threshold * span:
+            im.set_clim(clim)
+            self._full_draw = True
         
+    def _scroll(self, ring, column):
+        """
+        Writes the newest column into both halves of the ring and returns
+        the history, newest first, as a view.
+        """
+        ring[:, self._hist_pntr] = column
+        ring[:, self._hist_pntr + self._history] = column
+        return ring[:, self._hist_pntr:self._hist_pntr + self._history]
+
     def ave_wc(self, data_array):
+        return self.wc_filter.add(data_array)
+
+
+class along_track_filter:
+    """
+    High pass filters pings along track by taking off the average of the
+    last low_pass_len pings, ignoring NaN.  The average is kept as a running
+    sum (float64) and count of the valid samples, so a ping costs the same
+    whatever low_pass_len is.  The pings in the window are kept to take them
+    back out.  To keep rounding from building up in the sum a few rows of it
+    are summed afresh from the window with each ping, working down through
+    all of the rows every low_pass_len pings.  Rows start at max_samples (a
+    guess at the max range) and grow if needed.
+    """
+    def __init__(self, beams, low_pass_len = 10, max_samples = 4000):
+        self._wc_ave_pntr = 0
+        self._total_wc_ave = low_pass_len
+        self.wc_buff = np.zeros((self._total_wc_ave, max_samples, beams), dtype = np.float32)
+        self.wc_buff[:,:,:] = np.nan
+        self._wc_sum = np.zeros((max_samples, beams))
+        self._wc_count = np.zeros((max_samples, beams), dtype = np.int32)
+        self._resum_pntr = 0
+
+    def add(self, data_array):
+        """
+        Adds the ping to the window and returns it with the average taken
+        off.
+        """
         if self._wc_ave_pntr >= self._total_wc_ave:
             self._wc_ave_pntr = 0
         numsamples = data_array.shape[0]
-        self.wc_buff[:numsamples,:,self._wc_ave_pntr] = data_array
-        wc_mean = np.nanmean(self.wc_buff, axis = 2)
-        wc_mean_out = data_array - wc_mean[:numsamples, :]
+        if numsamples > self.wc_buff.shape[1]:
+            self._grow_wc(numsamples)
+        # swap the oldest ping in the window for this one
+        slot = self.wc_buff[self._wc_ave_pntr, :numsamples]
+        wc_sum = self._wc_sum[:numsamples]
+        wc_count = self._wc_count[:numsamples]
+        valid = ~np.isnan(slot)
+        wc_sum -= np.where(valid, slot, 0)
+        wc_count -= valid
+        slot[:,:] = data_array
+        valid = ~np.isnan(slot)
+        wc_sum += np.where(valid, slot, 0)
+        wc_count += valid
+        self._resum_rows()
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            wc_mean = wc_sum / wc_count
+        wc_mean_out = data_array - wc_mean
         self._wc_ave_pntr += 1
         return wc_mean_out
+
+    def _resum_rows(self):
+        """
+        Sums the next rows of the running sum afresh from the window.  The
+        count is exact and never needs it.
+        """
+        rows = self.wc_buff.shape[1]
+        step = -(-rows // self._total_wc_ave)
+        if self._resum_pntr >= rows:
+            self._resum_pntr = 0
+        chunk = slice(self._resum_pntr, self._resum_pntr + step)
+        window = self.wc_buff[:, chunk]
+        self._wc_sum[chunk] = np.where(np.isnan(window), 0, window).sum(axis = 0,
+            dtype = np.float64)
+        self._resum_pntr += step
+
+    def _grow_wc(self, numsamples):
+        """
+        Adds rows to the along track window for pings longer than any so far.
+        """
+        old = self.wc_buff
+        rows = max(numsamples, int(1.25 * old.shape[1]))
+        self.wc_buff = np.zeros((old.shape[0], rows, old.shape[2]), dtype = np.float32)
+        self.wc_buff[:,:,:] = np.nan
+        self.wc_buff[:, :old.shape[1]] = old
+        # the new rows are empty in every ping in the window
+        extra = np.zeros((rows - old.shape[1], old.shape[2]))
+        self._wc_sum = np.vstack((self._wc_sum, extra))
+        self._wc_count = np.vstack((self._wc_count, extra.astype(np.int32)))
         
       
 class color_range_tracker:
-    def __init__(self, numpts = 200, multiplier = 2, debug = False):
+    """
+    Tracks the mean and standard deviation of the last numpts pings to set
+    the color limits of a plot at the mean of the means plus or minus the
+    multiplier times the mean of the standard deviations.  The history is a
+    ring with running totals of the valid entries, so adding a ping and
+    getting the limits cost the same whatever numpts is.  The ping statistics
+    are taken over every subsample'th value in two passes, the mean in
+    float64 and then the squared deviations from it, so the variance is not
+    lost to cancellation far from zero as it would be with a one pass sum of
+    squares.
+    """
+
+    def __init__(self, numpts = 200, multiplier = 2, debug = False, subsample = 1):
         self.cstd = np.zeros(numpts) + np.nan
         self.cmean = np.zeros(numpts) + np.nan
         self._m = multiplier
         self._debug = debug
-        
+        self._subsample = subsample
+        self._pntr = 0
+        self._adds = 0
+        self._resum()
+
     def add(self, data):
-        self.cstd = np.roll(self.cstd, 1)
-        self.cstd[0] = np.nanstd(data)
-        self.cmean = np.roll(self.cmean,1)
-        self.cmean[0] = np.nanmean(data)
-        
+        values = np.ravel(data)[::self._subsample]
+        values = values[~np.isnan(values)]
+        if len(values) > 0:
+            mean = values.mean(dtype = np.float64)
+            dev = values - mean
+            std = np.sqrt(np.dot(dev, dev) / float(len(values)))
+        else:
+            mean = np.nan
+            std = np.nan
+        # swap the oldest entry for this one
+        self._pntr = (self._pntr - 1) % len(self.cmean)
+        self._remove(self.cmean[self._pntr], self.cstd[self._pntr])
+        self.cmean[self._pntr] = mean
+        self.cstd[self._pntr] = std
+        if not np.isnan(mean):
+            self._mean_sum += mean
+            self._std_sum += std
+            self._count += 1
+        # rebuild the totals once per trip around the ring so rounding can
+        # not build up
+        self._adds += 1
+        if self._adds >= len(self.cmean):
+            self._adds = 0
+            self._resum()
+
+    def _remove(self, mean, std):
+        if not np.isnan(mean):
+            self._mean_sum -= mean
+            self._std_sum -= std
+            self._count -= 1
+
+    def _resum(self):
+        valid = ~np.isnan(self.cmean)
+        self._mean_sum = self.cmean[valid].sum()
+        self._std_sum = self.cstd[valid].sum()
+        self._count = valid.sum()
+
     def minmax(self):
-        cmin = np.nanmean(self.cmean) - self._m * np.nanmean(self.cstd)
-        cmax = np.nanmean(self.cmean) + self._m * np.nanmean(self.cstd)
+        if self._count > 0:
+            mean = self._mean_sum / self._count
+            std = self._std_sum / self._count
+        else:
+            mean = np.nan
+            std = np.nan
+        cmin = mean - self._m * std
+        cmax = mean + self._m * std
         if self._debug:
-            nummeanused = len(np.nonzero(np.isnan(self.cmean)==False)[0])
-            numstdused = len(np.nonzero(np.isnan(self.cstd)==False)[0])
+            numstdused = np.sum(~np.isnan(self.cstd))
+            nummeanused = np.sum(~np.isnan(self.cmean))
             print numstdused, nummeanused
             print cmin, cmax
             print
         return cmin, cmax
-    
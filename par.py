@@ -53,10 +53,12 @@ and are also described in more detail in their docstrings.
 import numpy as np
 from numpy import sin, cos, pi
 from numpy import fft
-from matplotlib import pyplot as plt
-from mpl_toolkits.basemap import pyproj
+from numpy.lib.stride_tricks import as_strided
 import datetime as dtm
 import sys, os, copy
+import collections
+import mmap
+import multiprocessing
 import pickle
 from glob import glob
 try:
@@ -73,7 +75,24 @@ except ImportError:
 import warnings
 warnings.simplefilter('ignore', np.RankWarning)
 
-plt.ion()
+class _lazy_pyplot(object):
+    """
+    Stands in for matplotlib.pyplot until something is plotted so that
+    reading and decoding data (as in the headless monitor) never loads
+    pyplot or a GUI backend.  Interactive mode is turned on when pyplot is
+    loaded, as it always was.
+    """
+    def __init__(self):
+        self._pyplot = None
+
+    def __getattr__(self, name):
+        if self._pyplot is None:
+            from matplotlib import pyplot
+            pyplot.ion()
+            self._pyplot = pyplot
+        return getattr(self._pyplot, name)
+
+plt = _lazy_pyplot()
     
 class allRead:
     """
@@ -110,12 +129,35 @@ class allRead:
     for these records (record number) is listed in this map and can be used as 
     a reference when working from the commandline.
     
+    With use_mmap set the file is memory mapped and each record is handed to
+    the Datagram class as a read only buffer into the map, so nothing is
+    copied out of the file until the record is decoded.  The map has the same
+    seek and tell methods as the file, so it takes the place of 'infile'.
+    
     """
-    def __init__(self, infilename, verbose = False, byteswap = False):
+    
+    # the datagram header with the ping counter that starts the watercolumn
+    # datablock, which is all that is read when mapping the file.
+    map_dtype = np.dtype([('Bytes','I'),('Start','B'),('Type','B'),
+        ('Model','H'),('Date','I'),('Time','I'),('PingCounter','H')])
+    
+    # the binary index file holding the file map and navigation arrays.
+    index_magic = 'KMINDEX\x00'
+    index_version = 2
+    index_hdr_dtype = np.dtype([('Version','<H'),('SourceSize','<u8'),
+        ('SourceMtime','<f8'),('NumWC','<i8'),('NumArrays','<u4')])
+    index_entry_dtype = np.dtype([('Name','S32'),('Dtype','S8'),('NDim','<u1'),
+        ('Shape','<u8',(2,)),('Offset','<u8')])
+    
+    def __init__(self, infilename, verbose = False, byteswap = False, use_mmap = False):
         """Make a instance of the allRead class."""
         self.infilename = infilename
         self.byteswap = byteswap
+        self.use_mmap = use_mmap
         self.infile = open(infilename, 'rb')
+        if use_mmap:
+            self._filehandle = self.infile
+            self.infile = mmap.mmap(self._filehandle.fileno(), 0, access = mmap.ACCESS_READ)
         self.mapped = False
         self.packet_read = False
         self.eof = False
@@ -129,6 +171,8 @@ class allRead:
         Close the file from which the data is being read.
         """
         self.infile.close()
+        if self.use_mmap:
+            self._filehandle.close()
         
     def read(self):
         """
@@ -137,13 +181,22 @@ class allRead:
         if self.infile.tell() == self.filelen:
                 self.eof = True
         if not self.eof:
-            if self.byteswap:
-                packetsize = 4 + np.fromfile(self.infile, dtype=np.uint32, count=1)[0].newbyteorder()
+            if self.use_mmap:
+                loc = self.infile.tell()
+                packetsize = np.frombuffer(self.infile, dtype=np.uint32, count=1, offset=loc)[0]
             else:
-                packetsize = 4 + np.fromfile(self.infile, dtype=np.uint32, count=1)[0]
-            self.infile.seek(-4, 1)
+                packetsize = np.fromfile(self.infile, dtype=np.uint32, count=1)[0]
+                self.infile.seek(-4, 1)
+            if self.byteswap:
+                packetsize = packetsize.newbyteorder()
+            packetsize = 4 + packetsize
             if self.filelen >= self.infile.tell() + packetsize:
-                self.packet = Datagram(self.infile.read(packetsize), self.byteswap)
+                if self.use_mmap:
+                    # a buffer into the map rather than a copy of the record
+                    self.packet = Datagram(buffer(self.infile, loc, packetsize), self.byteswap)
+                    self.infile.seek(packetsize, 1)
+                else:
+                    self.packet = Datagram(self.infile.read(packetsize), self.byteswap)
                 self.packet_read = True
                 if not self.packet.valid:
                     self.error = True
@@ -165,35 +218,17 @@ class allRead:
         
     def mapfile(self, verbose = False):
         """
-        Maps the datagrams in the file.
+        Maps the datagrams in the file.  Only the datagram header and the
+        fields needed for the map are read for each record, so nothing is
+        decoded while mapping.
         """
-        progress = 0
         if not self.mapped:
             self.map = mappack()
             self.reset()
             print 'Mapping file;           ',
-            while not self.eof:
-                loc = self.infile.tell()
-                self.read()
-                dtype = self.packet.header[2]
-                dsize = self.packet.header[0]
-                time = self.packet.gettime()
-                if dtype == 107:
-                    self.get()
-                    pingcounter = self.packet.subpack.header['PingCounter']
-                    self.map.add(str(dtype), loc, time, dsize, pingcounter)
-                else:
-                    self.map.add(str(dtype), loc, time, dsize)
-                current = 100 * loc / self.filelen
-                if current - progress >= 1:
-                    progress = current
-                    sys.stdout.write('\b\b\b\b\b\b\b\b\b\b%(percent)02d percent' %{'percent':progress})
+            locs, hdrs = self._scan_records(0)
+            self._add_records(locs, hdrs)
             self.reset()
-            # make map into an array and sort by the time stamp
-            self.map.finalize()
-            # set the number of watercolumn packets into the map object
-            pinglist = list(set(self.map.packdir['107'][:,3]))
-            self.map.numwc = len(pinglist)
             if self.error:
                 print
             else:
@@ -203,33 +238,278 @@ class allRead:
             self.mapped = True
         else:
             pass
+            
+    def update(self):
+        """
+        Maps the records written to the end of the file since it was mapped,
+        such as while a file is still being logged, and adds them to the map.
+        If the navigation array exists it is extended with the new records.
+        Returns the number of records added.
+        """
+        if not self.mapped:
+            self.mapfile()
+            return 0
+        numnew = self._map_tail()
+        if numnew > 0:
+            if hasattr(self, 'navarray'):
+                self._build_navarray(allrecords = self._navcount.has_key('110'),
+                    first = self._navcount)
+            # these are rebuilt from the map and navarray when next needed
+            for name in ['speedarray', '_runtime_array', '_sscast_array']:
+                if hasattr(self, name):
+                    delattr(self, name)
+        return numnew
+        
+    def _map_tail(self):
+        """
+        Adds any complete records past the end of the map to the map and
+        returns how many were added.  A record that is only partly written is
+        left for the next time.
+        """
+        if self.use_mmap:
+            # the map does not grow with the file, so map it again.  The old
+            # one is released once nothing refers to it.
+            self.infile = mmap.mmap(self._filehandle.fileno(), 0, access = mmap.ACCESS_READ)
+        self.infile.seek(0,2)
+        self.filelen = self.infile.tell()
+        start = self.map.getend()
+        if start >= self.filelen:
+            return 0
+        locs, hdrs = self._scan_records(start, tail = True)
+        self._add_records(locs, hdrs)
+        self.reset()
+        return len(locs)
+        
+    def _scan_records(self, start, tail = False):
+        """
+        Walks the records from the byte start to the end of the file and
+        returns a list of the record locations and a list of their headers,
+        read with the map_dtype.  If tail is set a broken last record is
+        assumed to still be being written, so it is not reported and the
+        progress is not printed.
+        """
+        progress = 0
+        map_sz = allRead.map_dtype.itemsize
+        locs = []
+        hdrs = []
+        loc = start
+        while loc < self.filelen:
+            if loc + map_sz > self.filelen:
+                if not tail:
+                    self.error = True
+                    print "Broken packet found at", loc
+                break
+            if self.use_mmap:
+                block = self.infile[loc:loc + map_sz]
+            else:
+                self.infile.seek(loc)
+                block = self.infile.read(map_sz)
+            hdr = np.frombuffer(block, dtype = allRead.map_dtype)
+            if self.byteswap:
+                hdr = hdr.byteswap()
+            packetsize = 4 + int(hdr['Bytes'][0])
+            if loc + packetsize > self.filelen:
+                if not tail:
+                    self.error = True
+                    print "Broken packet found at", loc
+                    print "Final packet size", packetsize
+                break
+            if self.use_mmap:
+                etx = self.infile[loc + packetsize - 3]
+            else:
+                self.infile.seek(loc + packetsize - 3)
+                etx = self.infile.read(1)
+            if hdr['Start'][0] != 2 or ord(etx) != 3:
+                self.error = True
+                print "Record without proper STX or ETX found."
+            locs.append(loc)
+            hdrs.append(hdr)
+            loc += packetsize
+            current = 100 * loc / self.filelen
+            if not tail and current - progress >= 1:
+                progress = current
+                sys.stdout.write('\b\b\b\b\b\b\b\b\b\b%(percent)02d percent' %{'percent':progress})
+        return locs, hdrs
+        
+    def _add_records(self, locs, hdrs):
+        """
+        Adds the records found by _scan_records to the map, by type, and
+        updates the number of watercolumn pings.
+        """
+        if len(hdrs) > 0:
+            hdrs = np.concatenate(hdrs)
+            locs = np.asarray(locs)
+            times = posixtime(hdrs['Date'], hdrs['Time'])
+            for dtype in np.unique(hdrs['Type']):
+                idx = np.nonzero(hdrs['Type'] == dtype)[0]
+                cols = [locs[idx], times[idx], hdrs['Bytes'][idx]]
+                if dtype == 107:
+                    cols.append(hdrs['PingCounter'][idx])
+                self.map.extend(str(dtype), np.column_stack(cols).astype(np.float64))
+        # set the number of watercolumn packets into the map object
+        if self.map.packdir.has_key('107'):
+            pinglist = list(set(self.map.packdir['107'][:,3]))
+            self.map.numwc = len(pinglist)
         
     def loadfilemap(self, mapfilename = ''):
         """
-        Loads the packdir if the map object packdir has been saved previously.
+        Loads the file map from the index file if the index was made from the
+        file as it is now.  A pickled map from older versions can be loaded by
+        providing its name as mapfilename.  If the file has grown since the
+        index was written the new records are mapped and added.
         """
         if mapfilename == '':
-            mapfilename = self.infilename[:-3] + 'par'
-        try:
+            index = self._read_index(allow_growth = True)
+            if index is None:
+                print self._index_name() + ' map file not found or out of date.'
+                return
+            header, arrays = index
             self.map = mappack()
-            self.map.load(mapfilename)
+            for name, arr in arrays.iteritems():
+                if name.startswith('packdir/'):
+                    self.map.packdir[name[8:]] = arr
+            for dtype, size in arrays['sizedir']:
+                self.map.sizedir[str(dtype)] = size
+            if header['NumWC'] >= 0:
+                self.map.numwc = int(header['NumWC'])
             self.mapped = True
-            print 'loaded file map ' + mapfilename
-        except IOError:
-            print mapfilename + ' map file not found.'
+            print 'loaded file map ' + self._index_name()
+            if header['SourceSize'] < self.filelen:
+                self._map_tail()
+        else:
+            try:
+                self.map = mappack()
+                self.map.load(mapfilename)
+                self.mapped = True
+                print 'loaded file map ' + mapfilename
+            except IOError:
+                print mapfilename + ' map file not found.'
             
     def savefilemap(self):
         """
         Saves the mappack packdir dictionary for faster operations on a file in
-        the future.  The file is saved under the same name as the loaded file
-        but with a 'par' extension.
+        the future.  The map is saved in the index file, which has the same
+        name as the loaded file but with an 'idx' extension.
         """
         if self.mapped:
-            mapfilename = self.infilename[:-3] + 'par'
-            self.map.save(mapfilename)
-            print 'file map saved to ' + mapfilename
+            self.save_index()
+            print 'file map saved to ' + self._index_name()
         else:
             print 'no map to save.'
+            
+    def _index_name(self):
+        """
+        Returns the name of the index file for this file.
+        """
+        return self.infilename[:-3] + 'idx'
+        
+    def save_index(self):
+        """
+        Writes the file map and the navigation arrays, whichever exist, to the
+        index file.  The index starts with a header holding the format version
+        and the size and modification time of the source file, followed by a
+        table of the arrays stored.  Each array is written raw and aligned so
+        that it can be memory mapped when loaded.
+        """
+        self._unmap_index()
+        arrays = {}
+        numwc = -1
+        if self.mapped:
+            for dtype, arr in self.map.packdir.iteritems():
+                arrays['packdir/' + dtype] = arr
+            sizedir = [(int(dtype), size) for dtype, size in self.map.sizedir.iteritems()]
+            arrays['sizedir'] = np.array(sizedir, dtype = np.uint64).reshape(-1,2)
+            if self.map.numwc is not None:
+                numwc = self.map.numwc
+        if hasattr(self, 'navarray'):
+            for dtype, arr in self.navarray.iteritems():
+                arrays['navarray/' + dtype] = arr
+            navcount = [(int(dtype), num) for dtype, num in self._navcount.iteritems()]
+            arrays['navcount'] = np.array(navcount, dtype = np.uint64).reshape(-1,2)
+        names = sorted(arrays.keys())
+        table = np.zeros(len(names), dtype = allRead.index_entry_dtype)
+        offset = len(allRead.index_magic) + allRead.index_hdr_dtype.itemsize + table.nbytes
+        for n, name in enumerate(names):
+            arr = np.asarray(arrays[name])
+            offset += -offset % 64
+            table[n]['Name'] = name
+            table[n]['Dtype'] = arr.dtype.str
+            table[n]['NDim'] = arr.ndim
+            table[n]['Shape'][:arr.ndim] = arr.shape
+            table[n]['Offset'] = offset
+            offset += arr.nbytes
+        header = np.zeros(1, dtype = allRead.index_hdr_dtype)
+        header['Version'] = allRead.index_version
+        # the size is where the map ends, so a file that has grown since it
+        # was opened is seen as having grown when the index is next read
+        header['SourceSize'] = self.filelen
+        header['SourceMtime'] = os.stat(self.infilename).st_mtime
+        header['NumWC'] = numwc
+        header['NumArrays'] = len(names)
+        # write to a temporary file so a reader never sees half an index
+        indexname = self._index_name()
+        outfile = open(indexname + '.tmp', 'wb')
+        outfile.write(allRead.index_magic)
+        outfile.write(header.tobytes())
+        outfile.write(table.tobytes())
+        for n, name in enumerate(names):
+            outfile.seek(int(table[n]['Offset']))
+            outfile.write(np.ascontiguousarray(arrays[name]).tobytes())
+        outfile.close()
+        _replace_file(indexname + '.tmp', indexname)
+
+    def _unmap_index(self):
+        """
+        Copies any arrays of the map and navigation that are still memory
+        mapped from the index file into memory, so that the maps are closed
+        and the index file can be replaced (Windows will not replace a file
+        that is mapped).
+        """
+        dirs = []
+        if self.mapped:
+            dirs.append(self.map.packdir)
+        if self.__dict__.has_key('navarray'):
+            dirs.append(self.navarray)
+        for arrays in dirs:
+            for name, arr in arrays.items():
+                if isinstance(arr, np.memmap):
+                    arrays[name] = np.array(arr)
+        
+    def _read_index(self, allow_growth = False):
+        """
+        Reads the index file and returns the header and a dictionary of the
+        arrays stored, which are memory mapped copy-on-write.  None is returned
+        if there is no index, if it is a different version, or if the source
+        file has changed since the index was written.  With allow_growth the
+        index is also returned if the source file is now larger.
+        """
+        indexname = self._index_name()
+        if not os.path.isfile(indexname):
+            return None
+        infile = open(indexname, 'rb')
+        if infile.read(len(allRead.index_magic)) != allRead.index_magic:
+            infile.close()
+            return None
+        header = np.fromfile(infile, dtype = allRead.index_hdr_dtype, count = 1)[0]
+        table = np.fromfile(infile, dtype = allRead.index_entry_dtype, count = header['NumArrays'])
+        infile.close()
+        if header['Version'] != allRead.index_version:
+            return None
+        source = os.stat(self.infilename)
+        if header['SourceSize'] == source.st_size:
+            if header['SourceMtime'] != source.st_mtime:
+                return None
+        elif not allow_growth or header['SourceSize'] > source.st_size:
+            return None
+        arrays = {}
+        for entry in table:
+            shape = tuple(int(n) for n in entry['Shape'][:entry['NDim']])
+            if np.prod(shape) == 0:
+                arrays[entry['Name']] = np.zeros(shape, dtype = entry['Dtype'])
+            else:
+                arrays[entry['Name']] = np.memmap(indexname, dtype = entry['Dtype'],
+                    mode = 'c', offset = int(entry['Offset']), shape = shape)
+        return header, arrays
         
     def getrecord(self, recordtype, recordnum):
         """
@@ -241,7 +521,7 @@ class allRead:
             self.mapfile()
         if self.map.packdir.has_key(str(recordtype)):
             loc = self.map.packdir[str(recordtype)][recordnum][0]
-            self.infile.seek(loc)
+            self.infile.seek(int(loc))
             self.read()
             self.get()
             return self.packet.subpack
@@ -263,12 +543,57 @@ class allRead:
                 self.read()
         self.get()
         
-    def getwatercolumn(self,recordnum):
+    def getfields(self, recordtype, fields = None, first = 0):
+        """
+        Returns a structured array of the header fields listed in 'fields'
+        for all the records of the described record type, in the order of the
+        map.  All header fields are returned if no fields are listed, and the
+        records before record number 'first' are skipped.  The headers are
+        read straight from the file for all the records at once and converted
+        the same way the record decoder does, without making a Datagram for
+        each record.  This works for record types whose decoder class has a
+        raw_hdr_dtype and a scale_header method, such as 80, 82 and 104.
+        """
+        if not self.mapped:
+            self.mapfile()
+        recordtype = str(recordtype)
+        dclass = globals().get('Data' + recordtype)
+        if not hasattr(dclass, 'raw_hdr_dtype'):
+            print "record " + recordtype + " is not supported for field access."
+            return None
+        if not self.map.packdir.has_key(recordtype):
+            print "record " + recordtype + " not available."
+            return None
+        raw_dtype = dclass.raw_hdr_dtype
+        if self.byteswap:
+            raw_dtype = raw_dtype.newbyteorder()
+        hdr_sz = raw_dtype.itemsize
+        # the record header follows the datagram header
+        locs = self.map.packdir[recordtype][first:,0].astype(np.int64) + Datagram.hdr_dtype.itemsize
+        if self.use_mmap:
+            filedata = np.frombuffer(self.infile, dtype = np.uint8)
+            raw = filedata[locs[:,np.newaxis] + np.arange(hdr_sz)]
+            header = raw.view(raw_dtype).reshape(len(locs))
+        else:
+            blocks = []
+            for loc in locs:
+                self.infile.seek(loc)
+                blocks.append(self.infile.read(hdr_sz))
+            header = np.frombuffer(''.join(blocks), dtype = raw_dtype)
+        header = header.astype(dclass.hdr_dtype)
+        dclass.scale_header(header)
+        if fields is None:
+            return header
+        else:
+            return header[fields]
+            
+    def getwatercolumn(self, recordnum, raw = False):
         """
         This method is designed to get a watercolumn packet by the ping number
         where ping 0 is the first in the file.  Separate records are
         reassembled for the whole ping and stored as the current subpack class
-        as if it were a single record.
+        as if it were a single record.  Set the kwarg raw to keep the ping as
+        int8 (see _assemble_wc).
         """
         # dt is for looking for packets with different time stamps.
         if not self.mapped:
@@ -281,39 +606,147 @@ class allRead:
         else:
             pingnum = pinglist[recordnum]
             inx = np.nonzero(self.map.packdir['107'][:,3] == pingnum)[0]
-            ping = self.getrecord(107,inx[0])
-            numbeams = ping.header['Total#Beams']
-            recordsremaining = range(ping.header['#OfDatagrams'])
-            recordsremaining.pop(ping.header['Datagram#']-1)
-            totalsamples, subbeams = ping.ampdata.shape
-            rx = np.zeros(numbeams, dtype = Data107.nrx_dtype)
-            ampdata = np.zeros((totalsamples, numbeams), dtype = np.float32)
-            rx[:subbeams] = ping.rx
-            ampdata[:,:subbeams] = ping.ampdata
-            beamcount = subbeams
-            if len(inx) > 1:
-                for n in inx[1:]:
-                    ping = self.getrecord(107, n)
-                    recordnumber = recordsremaining.index(ping.header['Datagram#']-1)
-                    recordsremaining.pop(recordnumber)
-                    numsamples, subbeams = ping.ampdata.shape
-                    if numsamples > totalsamples:
-                        temp = np.zeros((numsamples - totalsamples, numbeams), dtype = 'b')
-                        ampdata = np.append(ampdata, temp, axis = 0)
-                        totalsamples = numsamples
-                    rx[beamcount:beamcount+subbeams] = ping.rx
-                    ampdata[:numsamples,beamcount:beamcount+subbeams] = ping.ampdata
-                    beamcount += subbeams
-            if len(recordsremaining) > 0:
-                print "Warning: Not all WC records have the same time stamp!"
-            sortidx = np.argsort(rx['BeamPointingAngle'])
-            self.packet.subpack.rx = rx[sortidx]
-            self.packet.subpack.ampdata = ampdata[:,sortidx]
-            self.packet.subpack.header[2] = 1
-            self.packet.subpack.header[3] = 1
-            self.packet.subpack.header[6] = numbeams
-            return self.packet.subpack
+            pings = []
+            for n in inx:
+                pings.append(self.getrecord(107, n))
+            return self._assemble_wc(pings, raw = raw)
+            
+    def _assemble_wc(self, pings, raw = False):
+        """
+        Puts the decoded watercolumn records of one ping, in the order they
+        were read, back together as if they were a single record.  The last
+        record is returned holding the whole ping with the beams sorted by
+        pointing angle.  With the kwarg raw set only the int8 rawamp is put
+        together and ampdata is made from it when it is used.  Either way
+        places not covered by any record are 0 dB.
+        """
+        if raw:
+            name = 'rawamp'
+            dtype = np.int8
+        else:
+            name = 'ampdata'
+            dtype = np.float32
+        ping = pings[0]
+        numbeams = ping.header['Total#Beams']
+        recordsremaining = range(ping.header['#OfDatagrams'])
+        recordsremaining.pop(ping.header['Datagram#']-1)
+        totalsamples, subbeams = getattr(ping, name).shape
+        rx = np.zeros(numbeams, dtype = Data107.nrx_dtype)
+        ampdata = np.zeros((totalsamples, numbeams), dtype = dtype)
+        rx[:subbeams] = ping.rx
+        ampdata[:,:subbeams] = getattr(ping, name)
+        beamcount = subbeams
+        for ping in pings[1:]:
+            recordnumber = recordsremaining.index(ping.header['Datagram#']-1)
+            recordsremaining.pop(recordnumber)
+            numsamples, subbeams = getattr(ping, name).shape
+            if numsamples > totalsamples:
+                temp = np.zeros((numsamples - totalsamples, numbeams), dtype = 'b')
+                ampdata = np.append(ampdata, temp, axis = 0)
+                totalsamples = numsamples
+            rx[beamcount:beamcount+subbeams] = ping.rx
+            ampdata[:numsamples,beamcount:beamcount+subbeams] = getattr(ping, name)
+            beamcount += subbeams
+        if len(recordsremaining) > 0:
+            print "Warning: Not all WC records have the same time stamp!"
+        sortidx = np.argsort(rx['BeamPointingAngle'])
+        ping.rx = rx[sortidx]
+        if raw:
+            ping.rawamp = ampdata[:,sortidx]
+            # ampdata is remade from the whole ping when it is used
+            if ping.__dict__.has_key('ampdata'):
+                del ping.ampdata
+        else:
+            ping.ampdata = ampdata[:,sortidx]
+        ping.header[2] = 1
+        ping.header[3] = 1
+        ping.header[6] = numbeams
+        return ping
+        
+    def iterrecords(self, recordtypes = [], decode = True, bufsize = 2**24):
+        """
+        A generator that steps forward through the file and yields each
+        record as a Datagram, decoded unless the kwarg decode is False.  Only
+        the record types in 'recordtypes' are yielded if any are listed.  The
+        file does not need to be mapped.  The file is read in blocks of
+        bufsize bytes with its own file handle (or straight from the memory
+        map with use_mmap), so the current record and file position of this
+        object are not changed.
+        """
+        recordtypes = [int(n) for n in recordtypes]
+        if self.use_mmap:
+            block = self.infile
+            infile = None
+        else:
+            block = ''
+            infile = open(self.infilename, 'rb')
+        offset = 0
+        while True:
+            if len(block) - offset < 4:
+                if infile is None:
+                    break
+                more = infile.read(bufsize)
+                if len(more) == 0:
+                    break
+                block = block[offset:] + more
+                offset = 0
+                continue
+            packetsize = np.frombuffer(block, dtype = np.uint32, count = 1, offset = offset)[0]
+            if self.byteswap:
+                packetsize = packetsize.newbyteorder()
+            packetsize = 4 + int(packetsize)
+            if len(block) - offset < packetsize:
+                more = ''
+                if infile is not None:
+                    more = infile.read(max(bufsize, packetsize))
+                if len(more) == 0:
+                    print "Broken packet found at end of file"
+                    print "Final packet size", packetsize
+                    break
+                block = block[offset:] + more
+                offset = 0
+                continue
+            # the record type is the sixth byte
+            dtype = ord(block[offset + 5])
+            if len(recordtypes) == 0 or dtype in recordtypes:
+                packet = Datagram(buffer(block, offset, packetsize), self.byteswap)
+                if not packet.valid:
+                    print "Record without proper STX or ETX found."
+                else:
+                    if decode:
+                        packet.decode()
+                    yield packet
+            offset += packetsize
+        if infile is not None:
+            infile.close()
             
+    def iterpings(self, bufsize = 2**24, raw = False):
+        """
+        A generator that steps forward through the file and yields each
+        watercolumn ping as a Datagram with the records for the ping put
+        together in the subpack, as from getwatercolumn.  Only one ping is
+        held at a time.  See iterrecords, and _assemble_wc for the kwarg raw.
+        """
+        packets = []
+        for packet in self.iterrecords([107], bufsize = bufsize):
+            wc = packet.subpack.header
+            if len(packets) > 0:
+                first = packets[0].subpack.header
+                if wc['PingCounter'] != first['PingCounter'] or wc['SystemSerial#'] != first['SystemSerial#']:
+                    # the rest of the last ping never came
+                    packets[-1].subpack = self._assemble_wc([p.subpack for p in packets], raw = raw)
+                    yield packets[-1]
+                    packets = []
+            packets.append(packet)
+            if len(packets) == wc['#OfDatagrams']:
+                packets[-1].subpack = self._assemble_wc([p.subpack for p in packets], raw = raw)
+                yield packets[-1]
+                packets = []
+        if len(packets) > 0:
+            packets[-1].subpack = self._assemble_wc([p.subpack for p in packets], raw = raw)
+            yield packets[-1]
+            
+
     def display(self):
         """
         Prints the current record header and record type header to the command
@@ -347,6 +780,8 @@ class allRead:
         pitch(deg), heave (meters), and heading (deg).  Time stamps are to be
         POSIX time stamps, and are assumed to be in UTC. Set the 'degrees'
         keyword to False have the returned attitude informaiton in radians.
+        All the time stamps are found in the navigation with one sorted search,
+        so it is best to ask for all the times needed in one call.
         """
         # make incoming tstamp shape more flexible
         tstamps = np.asarray(tstamps)
@@ -361,43 +796,71 @@ class allRead:
             self._build_navarray()
         # find bounding times for getting all needed nav data
         if self.navarray.has_key(str(att_type)) and self.navarray.has_key(str(postype)):
-            mintime = max(self.navarray[str(att_type)][0,0], self.navarray[str(postype)][0,0])
-            maxtime = min(self.navarray[str(att_type)][-1,0], self.navarray[str(postype)][-1,0])
+            pos = self._nav_in_order(self.navarray[str(postype)])
+            att = self._nav_in_order(self.navarray[str(att_type)])
             navpts = np.zeros((numpts,7))
-            # look for time stamps in the time range
-            idx_range = np.nonzero((tstamps <= maxtime) & (tstamps >= mintime))[0]
+            if len(pos) > 0 and len(att) > 0:
+                mintime = max(att[0,0], pos[0,0])
+                maxtime = min(att[-1,0], pos[-1,0])
+                # look for time stamps in the time range
+                idx_range = np.nonzero((tstamps <= maxtime) & (tstamps >= mintime))[0]
+            else:
+                idx_range = []
             if len(idx_range) > 0:
-                pos = self.navarray[str(postype)]
-                att = self.navarray[str(att_type)]
                 # for time stamps in the time range, find that nav and att
-                for i in idx_range:
-                    ts = tstamps[i]
-                    if ts > pos[0,0] and ts < pos[-1,0]:
-                        prev = np.nonzero(pos[:,0] <= ts)[0][-1]
-                        navpts[i,:3] = self._interp_points(tstamps[i], pos[prev,:], pos[prev + 1,:])
-                    else:
-                        navpts[i,:3] = np.nan
-                    if ts > att[0,0] and ts < att[-1,0]:
-                        prev = np.nonzero(att[:,0] <= tstamps[i])[0][-1]
-                        navpts[i,3:] = self._interp_points(tstamps[i], att[prev,:], att[prev + 1,:])[1:]
-                    else:
-                        navpts[i,3:] = np.nan
+                ts = tstamps[idx_range]
+                navpts[idx_range,:3] = self._interp_nav(ts, pos[:,:3])
+                # heading is the last of time, roll, pitch, heave, heading
+                navpts[idx_range,3:] = self._interp_nav(ts, att[:,:5], heading = 4)[:,1:]
             # convert roll(3), pitch(4) and heading(6) into radians 
             if not degrees:
                 navpts[:,[3,4,6]] = np.deg2rad(navpts[:,[3,4,6]])
             return navpts
                 
-    def _interp_points(self, tstamp, pt1, pt2):
-        """
-        Performs an interpolation for the points given and returns the
-        interpolated points.  The first field of each point array is assumed to
-        be the time stamp, and all other values in the array are interpolated.
-        """
-        delta = pt2 - pt1
-        result = pt1 + (tstamp - pt1[0]) * delta / delta[0]
+    def _nav_in_order(self, nav):
+        """
+        Returns the rows of the navigation array, with time in the first
+        column, that have a time and move time forward.  Position records from
+        systems other than the active one are left in the array with no time,
+        and these (or any time going backwards) would throw off the sorted
+        search in _interp_nav.
+        """
+        if len(nav) == 0:
+            return nav
+        times = nav[:,0]
+        keep = times > 0
+        keep[1:] &= times[1:] > np.maximum.accumulate(times)[:-1]
+        if keep.all():
+            return nav
+        return nav[keep]
+
+    def _interp_nav(self, tstamps, nav, heading = None):
+        """
+        Interpolates the navigation array, with time in the first column, at
+        each of the time stamps.  The times in the array are expected to be
+        increasing (see _nav_in_order).  The result is NaN for time stamps that are not inside the
+        times in the array.  The column given by 'heading' is interpolated the
+        short way around the circle, so that 359 and 1 degrees give 0.
+        """
+        times = nav[:,0]
+        result = np.empty((len(tstamps), nav.shape[1]))
+        result[:] = np.nan
+        inside = np.nonzero((tstamps > times[0]) & (tstamps < times[-1]))[0]
+        if len(inside) > 0:
+            ts = tstamps[inside]
+            prev = np.searchsorted(times, ts, side = 'right') - 1
+            pt1 = nav[prev]
+            delta = nav[prev + 1] - pt1
+            if heading is not None:
+                hdg = delta[:,heading]
+                hdg[hdg > 180] -= 360
+                hdg[hdg < -180] += 360
+            result[inside] = pt1 + (ts - pt1[:,0])[:,np.newaxis] * delta / delta[:,:1]
+            if heading is not None:
+                result[inside,heading] %= 360
         return result
             
-    def _build_navarray(self, allrecords = False):
+    def _build_navarray(self, allrecords = False, first = None):
         """
         The objective is to do the work of building an array of the navigation
         data to speed up processing later.  It is stored in a dictionary of
@@ -406,20 +869,28 @@ class allRead:
         arrays ordered as time, roll, pitch, heave, heading.
         Only an array for the first attitude sensor and first positioning
         sensor is pulled.
+        The kwarg first is a dictionary of the first record number to use for
+        each record type.  If provided the existing arrays are extended with
+        the records from there on rather than being built again.
         """
-        self.navarray = {}
+        if first is None:
+            self.navarray = {}
+            first = {}
         if not self.mapped:
             self.mapfile()
+        navcount = {}
         if self.map.packdir.has_key('80'):
             print 'creating position array'
+            start = first.get('80', 0)
             numpos = len(self.map.packdir['80'])
-            self.navarray['80'] = np.zeros((numpos,3))
-            for i in range(numpos):
-                self.getrecord(80, i)
-                if (self.packet.subpack.header['System'] & 3) == 1:
-                    self.navarray['80'][i,0] = self.packet.time
-                    self.navarray['80'][i,2] = self.packet.subpack.header[2]
-                    self.navarray['80'][i,1] = self.packet.subpack.header[3]
+            pos = np.zeros((numpos - start,3))
+            hdr = self.getfields(80, ['System','Latitude','Longitude'], first = start)
+            primary = (hdr['System'] & 3) == 1
+            pos[primary,0] = self.map.packdir['80'][start:,1][primary]
+            pos[primary,2] = hdr['Latitude'][primary]
+            pos[primary,1] = hdr['Longitude'][primary]
+            self._extend_navarray('80', pos)
+            navcount['80'] = numpos
         if self.map.packdir.has_key('65'):
             print 'creating attitude array (65)'
             time = []
@@ -428,7 +899,7 @@ class allRead:
             heave = []
             heading = []
             numatt = len(self.map.packdir['65'])
-            for m in range(numatt):
+            for m in range(first.get('65', 0), numatt):
                 p65 = self.getrecord(65, m)
                 if (p65.sensor_descriptor & 16) == 0: 
                     time += list(p65.data['Time'])
@@ -436,7 +907,8 @@ class allRead:
                     pitch += list(p65.data['Pitch'])
                     heave += list(p65.data['Heave'])
                     heading += list(p65.data['Heading'])
-            self.navarray['65'] = np.asarray(zip(time,roll,pitch,heave,heading))
+            self._extend_navarray('65', np.asarray(zip(time,roll,pitch,heave,heading)))
+            navcount['65'] = numatt
            
         if allrecords and self.map.packdir.has_key('110'):
             print 'creating attitude array (110)'
@@ -451,7 +923,7 @@ class allRead:
             yawrate = []
             downvel = []
             numatt = len(self.map.packdir['110'])
-            for m in range(numatt):
+            for m in range(first.get('110', 0), numatt):
                 pav = self.getrecord(110, m)
                 time += list(self.packet.subpack.data['Time'])
                 roll += list(self.packet.subpack.data['Roll'])
@@ -463,41 +935,70 @@ class allRead:
                 pitchrate += list(self.packet.subpack.source_data['PitchRate'])
                 yawrate += list(self.packet.subpack.source_data['YawRate'])
                 downvel += list(self.packet.subpack.source_data['DownVelocity'])
-            self.navarray['110'] = np.asarray(zip(time,roll,pitch,heave,heading,postime,rollrate,pitchrate,yawrate,downvel))
+            self._extend_navarray('110', np.asarray(zip(time,roll,pitch,heave,heading,postime,rollrate,pitchrate,yawrate,downvel)))
+            navcount['110'] = numatt
         if self.map.packdir.has_key('104'):
             print 'creating altitude (depth) array'
+            start = first.get('104', 0)
             num = len(self.map.packdir['104'])
-            self.navarray['104'] = np.zeros((num,2))
-            for n in range(num):
-                self.getrecord(104, n)
-                self.navarray['104'][n,0] = self.packet.gettime()
-                self.navarray['104'][n,1] = self.packet.subpack.header['Height']
+            height = np.zeros((num - start,2))
+            height[:,0] = self.map.packdir['104'][start:,1]
+            height[:,1] = self.getfields(104, ['Height'], first = start)['Height']
+            self._extend_navarray('104', height)
+            navcount['104'] = num
+        # the number of records of each type that are in the navarray
+        self._navcount = navcount
+        
+    def _extend_navarray(self, key, rows):
+        """
+        Adds the rows to the end of the navarray for the key.
+        """
+        if not self.navarray.has_key(key):
+            self.navarray[key] = rows
+        elif len(rows) > 0:
+            if len(self.navarray[key]) > 0:
+                self.navarray[key] = np.concatenate((self.navarray[key], rows))
+            else:
+                self.navarray[key] = rows
                 
     def save_navarray(self):
         """
-        Creats an 'npy' file with the name of the all file that contains the
-        navigation array used.
+        Saves the navigation array in the index file for this file, along with
+        the file map if there is one.
         """
         if not self.__dict__.has_key('navarray'):
             self._build_navarray()
         try:
-            navfile = open(self.infilename[:-3] + 'nav','wb')
-            pickle.dump(self.navarray, navfile)
-            navfile.close()
-            print "Saved navarray to " + self.infilename[:-3] + 'nav'
-        except:
+            self.save_index()
+            print "Saved navarray to " + self._index_name()
+        except IOError:
             pass
         
     def load_navarray(self):
         """
-        Loads an 'npy' file with the name of the all file that contains the
-        navigation array for this file name.
-        """
-        try:
-            navfile = open(self.infilename[:-3] + 'nav','rb')
-            self.navarray = pickle.load(navfile)
-            print "Loaded navarray from " + self.infilename[:-3] + "nav."
-        except:
+        Loads the navigation array from the index file for this file, if the
+        index holds navigation.  If the map has more records than were used for
+        the stored navigation, such as when the file has grown, the navigation
+        is extended with them.
+        """
+        index = self._read_index(allow_growth = True)
+        if index is not None and index[1].has_key('navcount'):
+            self.navarray = {}
+            for name, arr in index[1].iteritems():
+                if name.startswith('navarray/'):
+                    self.navarray[name[9:]] = arr
+            self._navcount = {}
+            for dtype, num in index[1]['navcount']:
+                self._navcount[str(dtype)] = int(num)
+            print "Loaded navarray from " + self._index_name()
+            if not self.mapped:
+                self.mapfile()
+            for dtype, num in self._navcount.iteritems():
+                if len(self.map.packdir[dtype]) > num:
+                    self._build_navarray(allrecords = self._navcount.has_key('110'),
+                        first = self._navcount)
+                    break
+        else:
             print "No navarray file found."
             
     def plot_navarray(self):
@@ -549,6 +1050,8 @@ class allRead:
             numpts = len(self.navarray['80'])-1
             self.speedarray = np.zeros((numpts,2))
             self.utmzone = int((180. + self.navarray['80'][0,1]) / 6) + 1
+            # basemap loads matplotlib, so it is only imported when needed
+            from mpl_toolkits.basemap import pyproj
             toutm = pyproj.Proj(proj = 'utm', zone = self.utmzone, ellps = 'WGS84')
             a,b = toutm(self.navarray['80'][:,1],self.navarray['80'][:,2])
             da = a[:-1] - a[1:]
@@ -559,10 +1062,8 @@ class allRead:
         else:
             num80 = len(self.map.packdir['80'])
             self.speedarray = np.zeros((num80,2))
-            for n in range(num80):
-                self.getrecord(80, n)
-                self.speedarray[n,1] = self.packet.subpack.header['Speed']
-                self.speedarray[n,0] = self.packet.gettime()
+            self.speedarray[:,0] = self.map.packdir['80'][:,1]
+            self.speedarray[:,1] = self.getfields(80, ['Speed'])['Speed']
                 
     def getspeed(self, tstamps, time_to_average = 1):
         """
@@ -635,10 +1136,8 @@ class allRead:
             self.mapfile()
         num = len(self.map.packdir['82'])
         self._runtime_array = np.zeros(num, dtype = rtp)
-        for n in range(num):
-            self.getrecord(82,n)
-            self._runtime_array[n]['Time'] = self.packet.gettime()
-            self._runtime_array[n]['RuntimePacket'] = self.packet.subpack.header
+        self._runtime_array['Time'] = self.map.packdir['82'][:,1]
+        self._runtime_array['RuntimePacket'] = self.getfields(82)
             
     def getruntime(self, time, values = []):
         """
@@ -764,6 +1263,9 @@ class allRead:
                         subpack[n] = self.getrecord(n,pingnumber)
                     elif n == '107':
                         subpack[n] = self.getwatercolumn(pingnumber)
+                # the datablock may be a buffer into a memory map, which
+                # cannot be copied, and is not needed from here on anyway.
+                del self.packet.datablock
                 temp = copy.deepcopy(self.packet)
                 if extra:
                     if pingtime == 0:
@@ -776,7 +1278,6 @@ class allRead:
                 # these fields are meaningless at this point.
                 self.packet.header['Type'] = 0
                 self.packet.header['Bytes'] = 0
-                del self.packet.datablock
                 self.packet.subpack = subpack
                 return subpack
             return None
@@ -815,7 +1316,11 @@ class Datagram:
             self.valid = True
         else:
             self.valid = False
-        self.datablock = fileblock[hdr_sz:-3]
+        if isinstance(fileblock, buffer):
+            # slicing a buffer makes a copy, so take a sub-buffer instead
+            self.datablock = buffer(fileblock, hdr_sz, len(fileblock) - hdr_sz - 3)
+        else:
+            self.datablock = fileblock[hdr_sz:-3]
         etx = np.frombuffer(fileblock[-3:-2], dtype=np.uint8, count=1)[0]
         if etx != 3:
             self.valid = False
@@ -887,13 +1392,7 @@ class Datagram:
         Makes the time stamp of the current packet as a POSIX time stamp.
         UTC is assumed.
         """
-        date = str(self.header[-2])
-        year = int(date[:4])
-        month = int(date[4:6])
-        day = int(date[6:])
-        numdays = dtm.date(year, month, day).toordinal() - dtm.date(1970,1,1).toordinal()
-        dayseconds = self.header[-1] * 0.001
-        self.time = numdays * 24 * 60 * 60 + dayseconds
+        self.time = posixtime(self.header['Date'], self.header['Time'])
         
     def gettime(self):
         """
@@ -1656,23 +2155,31 @@ class Data80:
     hdr_dtype = np.dtype([('Counter','H'),('Serial#','H'),('Latitude','d'),
         ('Longitude','d'),('Quality','f'),('Speed','f'),('Course','f'),
         ('Heading','f'),('System','B'),('NumberInputBytes','B')])
+    raw_hdr_dtype = np.dtype([('Counter','H'),('Serial#','H'),('Latitude','i'),
+        ('Longitude','i'),('Quality','H'),('Speed','H'),('Course','H'),
+        ('Heading','H'),('System','B'),('NumberInputBytes','B')])
     
     def __init__(self, datablock, byteswap = False):
         """Catches the binary datablock and decodes the record."""
-        hdr_dtype = np.dtype([('Counter','H'),('Serial#','H'),('Latitude','i'),
-            ('Longitude','i'),('Quality','H'),('Speed','H'),('Course','H'),
-            ('Heading','H'),('System','B'),('NumberInputBytes','B')])
-        hdr_sz = hdr_dtype.itemsize
-        self.header = np.frombuffer(datablock[:hdr_sz], dtype = hdr_dtype)[0]
+        hdr_sz = Data80.raw_hdr_dtype.itemsize
+        self.header = np.frombuffer(datablock[:hdr_sz], dtype = Data80.raw_hdr_dtype)[0]
         # read the original datagram, of which the size is the last part of the header.
         self.raw_data = datablock[hdr_sz:hdr_sz+self.header[-1]]
         self.header = self.header.astype(Data80.hdr_dtype)
-        self.header['Latitude'] /= 20000000.  # convert to degrees
-        self.header['Longitude'] /= 10000000.  # convert to degrees
-        self.header['Quality'] *= 0.01       # convert to meters
-        self.header['Speed'] *= 0.01       # convert to meters/second
-        self.header['Course'] *= 0.01       # convert to degrees
-        self.header['Heading'] *= 0.01       # convert to degrees
+        Data80.scale_header(self.header)
+        
+    @staticmethod
+    def scale_header(header):
+        """
+        Converts a header, or an array of headers, read with raw_hdr_dtype
+        and cast to hdr_dtype into degrees and meters.
+        """
+        header['Latitude'] /= 20000000.  # convert to degrees
+        header['Longitude'] /= 10000000.  # convert to degrees
+        _scale_field(header, 'Quality', 0.01)       # convert to meters
+        _scale_field(header, 'Speed', 0.01)       # convert to meters/second
+        _scale_field(header, 'Course', 0.01)       # convert to degrees
+        _scale_field(header, 'Heading', 0.01)       # convert to degrees
         
     def parse_raw(self):
         """
@@ -1742,30 +2249,38 @@ class Data82:
         ('YawAndPitchStabilization','B'),('MaxStarboardCoverage','B'),
         ('MaxStarboardSwathWidth','H'),('TransmitAlongTilt','f'),
         ('HiLoFrequencyAbsorptionCoeffRatio','B')])
+    raw_hdr_dtype = np.dtype([('Counter','H'),('SystemSerial#','H'),
+        ('OperatorStationStatus','B'),('ProcessingUnitStatus','B'),
+        ('BSPStatus','B'),('SonarHeadOrTransceiverStatus','B'),
+        ('Mode','B'),('FilterID','B'),('MinDepth','H'),('MaxDepth','H'),
+        ('AbsorptionCoefficent','H'),('TransmitPulseLength','H'),
+        ('TransmitBeamWidth','H'),('TransmitPower','b'),
+        ('ReceiveBeamWidth','B'),('ReceiveBandWidth50Hz','B'),
+        ('ReceiverFixedGain','B'),('TVGlawCrossoverAngle','B'),
+        ('SourceOfSoundSpeed','B'),('MaxPortSwathWidth','H'),
+        ('BeamSpacing','B'),('MaxPortCoverage','B'),
+        ('YawAndPitchStabilization','B'),('MaxStarboardCoverage','B'),
+        ('MaxStarboardSwathWidth','H'),('TransmitAlongTilt','h'),
+        ('HiLoFrequencyAbsorptionCoeffRatio','B')])
     
     def __init__(self, datablock, byteswap = False):
         """Catches the binary datablock and decodes the record."""
-        hdr_dtype = np.dtype([('Counter','H'),('SystemSerial#','H'),
-            ('OperatorStationStatus','B'),('ProcessingUnitStatus','B'),
-            ('BSPStatus','B'),('SonarHeadOrTransceiverStatus','B'),
-            ('Mode','B'),('FilterID','B'),('MinDepth','H'),('MaxDepth','H'),
-            ('AbsorptionCoefficent','H'),('TransmitPulseLength','H'),
-            ('TransmitBeamWidth','H'),('TransmitPower','b'),
-            ('ReceiveBeamWidth','B'),('ReceiveBandWidth50Hz','B'),
-            ('ReceiverFixedGain','B'),('TVGlawCrossoverAngle','B'),
-            ('SourceOfSoundSpeed','B'),('MaxPortSwathWidth','H'),
-            ('BeamSpacing','B'),('MaxPortCoverage','B'),
-            ('YawAndPitchStabilization','B'),('MaxStarboardCoverage','B'),
-            ('MaxStarboardSwathWidth','H'),('TransmitAlongTilt','h'),
-            ('HiLoFrequencyAbsorptionCoeffRatio','B')])
-        hdr_sz = hdr_dtype.itemsize
-        temp = np.frombuffer(datablock[:hdr_sz], dtype = hdr_dtype)[0]
+        hdr_sz = Data82.raw_hdr_dtype.itemsize
+        temp = np.frombuffer(datablock[:hdr_sz], dtype = Data82.raw_hdr_dtype)[0]
         self.header = temp.astype(Data82.hdr_dtype)
-        self.header['AbsorptionCoefficent'] *= 0.01
-        self.header['TransmitPulseLength'] *= 0.000001
-        self.header['TransmitBeamWidth'] *= 0.1
-        self.header['ReceiveBeamWidth'] *= 0.1
-        self.header['TransmitAlongTilt'] *= 0.1        
+        Data82.scale_header(self.header)
+        
+    @staticmethod
+    def scale_header(header):
+        """
+        Converts a header, or an array of headers, read with raw_hdr_dtype
+        and cast to hdr_dtype into whole units.
+        """
+        _scale_field(header, 'AbsorptionCoefficent', 0.01)
+        _scale_field(header, 'TransmitPulseLength', 0.000001)
+        _scale_field(header, 'TransmitBeamWidth', 0.1)
+        _scale_field(header, 'ReceiveBeamWidth', 0.1)
+        _scale_field(header, 'TransmitAlongTilt', 0.1)
     
     def print_byte(self, field_number):
         """
@@ -1884,15 +2399,9 @@ class Data85:
     def _maketime(self, date, time):
         """
         Makes the time stamp of the current packet as a POSIX time stamp.
-        UTC is assumed.
+        UTC is assumed.  The time in this record is in seconds.
         """
-        date = str(date)
-        year = int(date[:4])
-        month = int(date[4:6])
-        day = int(date[6:])
-        numdays = dtm.date(year, month, day).toordinal() - dtm.date(1970,1,1).toordinal()
-        dayseconds = time #* 0.001
-        return numdays * 24 * 60 * 60 + dayseconds
+        return posixtime(date, time, time_scale = 1.)
         
     def plot(self):
         """
@@ -2158,14 +2667,22 @@ class Data104:
     
     hdr_dtype = np.dtype([('Counter','H'),('SystemSerial#','H'),
         ('Height',"f"),('HeightType','B')])
+    raw_hdr_dtype = np.dtype([('Counter','H'),('SystemSerial#','H'),
+        ('Height',"i"),('HeightType','B')])
     
     def __init__(self, datablock, byteswap = False):
         """Catches the binary datablock and decodes the record."""
-        hdr_dtype = np.dtype([('Counter','H'),('SystemSerial#','H'),
-            ('Height',"i"),('HeightType','B')])
-        self.header = np.frombuffer(datablock, dtype = hdr_dtype)[0]
+        self.header = np.frombuffer(datablock, dtype = Data104.raw_hdr_dtype)[0]
         self.header = self.header.astype(Data104.hdr_dtype)
-        self.header['Height'] = 0.01 * self.header['Height']
+        Data104.scale_header(self.header)
+        
+    @staticmethod
+    def scale_header(header):
+        """
+        Converts a header, or an array of headers, read with raw_hdr_dtype
+        and cast to hdr_dtype into meters.
+        """
+        _scale_field(header, 'Height', 0.01)
         
     def display(self):
         """
@@ -2178,7 +2695,10 @@ class Data107:
     """
     The water column datagram, 6Bh / 107d / 'k'.  The receiver beams are roll
     stabilized.  Units have been shifted to whole units as in hertz, meters, 
-    seconds, etc.  Watercolumn data is in ampdata as 0.5 dB steps.
+    seconds, etc.  The raw watercolumn data is kept in rawamp as int8 0.5 dB
+    steps with Data107.missing where a beam has no sample.  ampdata, the
+    data in dB as float32 with NaN where there are no samples, is made from
+    rawamp the first time it is used.
     """
     hdr_dtype = np.dtype([('PingCounter','H'),('SystemSerial#','H'),
         ('#OfDatagrams','H'),('Datagram#','H'),('#TxSectors','H'),
@@ -2190,19 +2710,39 @@ class Data107:
     nrx_dtype = np.dtype([('BeamPointingAngle',"f"),('StartRangeSample#','H'),
         ('NumberSamples','H'),('DetectedRange','H'),('TransmitSector#','B'),
         ('Beam#','B')])
+    # the record as it is in the datagram
+    raw_hdr_dtype = np.dtype([('PingCounter','H'),('SystemSerial#','H'),
+        ('#OfDatagrams','H'),('Datagram#','H'),('#TxSectors','H'),
+        ('Total#Beams','H'),('NumberBeamsInDatagram','H'),('SoundSpeed',"H"),
+        ('SamplingFrequency',"I"),('TxHeave',"h"),('TVGfunction','B'),
+        ('TVGoffset','b'),('ScanningInfo','B'),('Spare','3B')])
+    raw_ntx_dtype = np.dtype([('TiltTx',"h"),('CenterFrequency',"H"),
+        ('TransmitSector#','B'),('Spare','B')])
+    raw_nrx_dtype = np.dtype([('BeamPointingAngle',"h"),
+        ('StartRangeSample#','H'),('NumberSamples','H'),
+        ('DetectedRange','H'),('TransmitSector#','B'),
+        ('Beam#','B')])
+    # the rawamp value where a beam has no sample
+    missing = -128
+    # False then True, see _beyond
+    _beyond_step = np.zeros(2048, dtype = np.bool_)
+    _beyond_step[1024:] = True
+    # linear power and amplitude for every rawamp value, indexed by rawamp
+    # viewed as uint8
+    _raw_db = np.arange(256, dtype = np.uint8).view(np.int8).astype(np.float32) * 0.5
+    power_lut = 10**(_raw_db.astype(np.float64) / 10.)
+    amplitude_lut = 10**(_raw_db / 20)
+    # TVG curves by the values they are made from, least recently used first
+    tvg_cache = collections.OrderedDict()
+    tvg_cache_size = 32
         
     def __init__(self, datablock, byteswap = False):
         """
         Catches the binary datablock and decodes the first section and calls
         the decoder for the rest of the record.
         """
-        hdr_dtype = np.dtype([('PingCounter','H'),('SystemSerial#','H'),
-            ('#OfDatagrams','H'),('Datagram#','H'),('#TxSectors','H'),
-            ('Total#Beams','H'),('NumberBeamsInDatagram','H'),('SoundSpeed',"H"),
-            ('SamplingFrequency',"I"),('TxHeave',"h"),('TVGfunction','B'),
-            ('TVGoffset','b'),('ScanningInfo','B'),('Spare','3B')])
-        hdr_sz = hdr_dtype.itemsize
-        self.header = np.frombuffer(datablock[:hdr_sz], dtype = hdr_dtype)[0]
+        hdr_sz = Data107.raw_hdr_dtype.itemsize
+        self.header = np.frombuffer(datablock[:hdr_sz], dtype = Data107.raw_hdr_dtype)[0]
         self.header = self.header.astype(Data107.hdr_dtype)
         self.header['SoundSpeed'] *= 0.1
         self.header['SamplingFrequency'] *= 0.01
@@ -2215,50 +2755,134 @@ class Data107:
         Reads the varable section of the datagram.
         """
         # declare tx stuff
-        ntx_dtype = np.dtype([('TiltTx',"h"),('CenterFrequency',"H"),
-            ('TransmitSector#','B'),('Spare','B')])
-        ntx_sz = ntx_dtype.itemsize    
-        ntx = self.header[4]
+        ntx_sz = Data107.raw_ntx_dtype.itemsize
+        ntx = int(self.header[4])
         # declare rx stuff
-        nrx_dtype = np.dtype([('BeamPointingAngle',"h"),
-            ('StartRangeSample#','H'),('NumberSamples','H'),
-            ('DetectedRange','H'),('TransmitSector#','B'),
-            ('Beam#','B')])
-        nrx_sz = nrx_dtype.itemsize
-        nrx = self.header[6]
-        self.rx = np.zeros(nrx, dtype = nrx_dtype)
-        # declare amplitudes stuff
-        numamp = len(datablock) - ntx_sz * ntx - nrx_sz * nrx
-        amp_dtype = np.dtype([('SampleAmplitude',"b")])
-        tempamp = np.zeros(numamp, dtype = amp_dtype)
+        nrx_sz = Data107.raw_nrx_dtype.itemsize
+        nrx = int(self.header[6])
         # get the tx data
-        self.tx = np.frombuffer(datablock[:ntx*ntx_sz], dtype = ntx_dtype)
+        self.tx = np.frombuffer(datablock[:ntx*ntx_sz], dtype = Data107.raw_ntx_dtype)
         p = ntx*ntx_sz
         self.tx = self.tx.astype(Data107.ntx_dtype)
         self.tx['TiltTx'] *= 0.01
         self.tx['CenterFrequency'] *= 10
-        # get the rx and amplitude data
-        pamp = 0
+        # walk the NumberSamples field (bytes 4 and 5 of each rx entry) to find
+        # where each beam starts.  Nothing else is decoded in this loop.
+        beamstart = []
         for n in range(nrx):
-            self.rx[n] = np.frombuffer(datablock[p:p+nrx_sz], 
-                dtype = nrx_dtype)
-            p += nrx_sz
-            # the number of samples for this beam
-            beamsz = self.rx[n][2]
-            tempamp[pamp:pamp+beamsz] = \
-                np.frombuffer(datablock[p:p+beamsz], dtype = amp_dtype)
-            p += beamsz
-            pamp += beamsz
+            beamstart.append(p)
+            p += nrx_sz + ord(datablock[p+4]) + (ord(datablock[p+5]) << 8)
+        beamstart = np.array(beamstart, dtype = np.intp)
+        # gather all the rx entries from the block at once
+        raw = np.frombuffer(datablock, dtype = np.uint8)
+        rx_idx = beamstart[:,np.newaxis] + np.arange(nrx_sz)
+        self.rx = raw[rx_idx].view(Data107.raw_nrx_dtype).reshape(nrx)
+        numsamples = self.rx['NumberSamples']
+        maxsamples = int(numsamples.max())
+        # a window of maxsamples bytes starting at every byte in the block, so
+        # that each beam's samples can be pulled with one row gather.  The
+        # beams too near the end of the block for a whole window (including a
+        # beam with no samples at the end of a block without the ETX and
+        # checksum, which starts at len(raw)) are pulled from a padded copy
+        # of the end of the block.  The beams are in order in the block, so
+        # those are always the last ones.
+        sampstart = beamstart + nrx_sz
+        tailstart = max(len(raw) - maxsamples, 0)
+        intail = np.searchsorted(sampstart, tailstart, side = 'right')
+        beamamp = np.empty((nrx, maxsamples), dtype = np.uint8)
+        window = as_strided(raw, shape = (tailstart + 1, maxsamples), strides = (1,1))
+        beamamp[:intail] = window[sampstart[:intail]]
+        tail = np.zeros(len(raw) - tailstart + 1 + maxsamples, dtype = np.uint8)
+        tail[:len(raw) - tailstart] = raw[tailstart:]
+        window = as_strided(tail, shape = (len(tail) - maxsamples, maxsamples),
+            strides = (1,1))
+        beamamp[intail:] = window[sampstart[intail:] - tailstart]
+        beamamp = beamamp.view(np.int8)
+        # anything past the number of samples in a beam belongs to the next beam
+        np.copyto(beamamp, Data107.missing, where = Data107._beyond(numsamples, maxsamples))
+        # the array is filled beam by beam, so rawamp is a transposed view
+        self.rawamp = beamamp.T
         self.rx = self.rx.astype(Data107.nrx_dtype)
         self.rx['BeamPointingAngle'] *= 0.01
-        # unwined the beam data into an array
-        numsamples = self.rx['NumberSamples']
-        self.ampdata = np.zeros((numsamples.max(), nrx), dtype = np.float32)
-        self.ampdata[:,:] = np.nan
-        pamp = 0
-        for n in range(nrx):
-            self.ampdata[:numsamples[n],n] = 0.5*tempamp[pamp:pamp+numsamples[n]].astype(np.float32)
-            pamp += numsamples[n]
+
+    def __getattr__(self, name):
+        """
+        Makes ampdata from rawamp the first time it is asked for.
+        """
+        if name == 'ampdata':
+            self.ampdata = self.getdb()
+            return self.ampdata
+        raise AttributeError(name)
+
+    def getdb(self):
+        """
+        Returns rawamp in dB as a float32 array with NaN where the beams have
+        no samples.  Only Data107.missing past the beam's NumberSamples counts
+        as missing so that a real sample at the bottom of the scale is kept.
+        """
+        db = np.empty_like(self.rawamp, dtype = np.float32)
+        db[...] = self.rawamp
+        db *= 0.5
+        # no beam is missing samples before the shortest beam ends
+        start = self.rx['NumberSamples'].min() if len(self.rx) > 0 else 0
+        np.copyto(db[start:], np.nan, where = self._nosample(start))
+        return db
+
+    def _nosample(self, start = 0):
+        """
+        Returns a boolean array the shape of rawamp from row start on that is
+        True where it is Data107.missing past the NumberSamples of the beam.
+        start must not be past the NumberSamples of any beam.  The decoder
+        fills rawamp beam by beam, so in that case the work is done beam by
+        beam too to keep to the order of the array in memory.
+        """
+        numsamples = self.rx['NumberSamples'] - start
+        if self.rawamp.flags.f_contiguous:
+            nosample = Data107._beyond(numsamples, len(self.rawamp) - start)
+            nosample &= self.rawamp.T[:, start:] == Data107.missing
+            return nosample.T
+        samplenum = np.arange(len(self.rawamp) - start, dtype = numsamples.dtype)
+        nosample = samplenum[:,np.newaxis] >= numsamples
+        nosample &= self.rawamp[start:] == Data107.missing
+        return nosample
+
+    @staticmethod
+    def _beyond(numsamples, maxsamples):
+        """
+        Returns a boolean array with a row of maxsamples for each beam that is
+        True past the NumberSamples of the beam.  The rows are gathered from a
+        window over a step of False then True, which is quicker than comparing
+        every sample number with every NumberSamples.
+        """
+        cap = len(Data107._beyond_step) // 2
+        if maxsamples > cap:
+            cap = max(maxsamples, 2 * cap)
+            Data107._beyond_step = np.zeros(2 * cap, dtype = np.bool_)
+            Data107._beyond_step[cap:] = True
+        # row r of the window is True from column cap - r on
+        window = as_strided(Data107._beyond_step, shape = (cap + 1, maxsamples),
+            strides = (1,1))
+        return window[cap - np.asarray(numsamples, dtype = np.intp)]
+
+    def getlinear(self, power = True):
+        """
+        Returns ampdata (with the TVG if it has not been removed) in linear
+        units, power by default or amplitude if the kwarg power is False.
+        Until ampdata has been made or the TVG removed this is a lookup of
+        rawamp in power_lut or amplitude_lut, which is much quicker than
+        raising to a power for every sample.
+        """
+        if self.hasTVG and not self.__dict__.has_key('ampdata'):
+            if power:
+                linear = Data107.power_lut[self.rawamp.view(np.uint8)]
+            else:
+                linear = Data107.amplitude_lut[self.rawamp.view(np.uint8)]
+            linear[self._nosample()] = np.nan
+            return linear
+        elif power:
+            return 10**(self.ampdata / 10.)
+        else:
+            return 10**(self.ampdata / 20.)
             
     def deTVG(self, absorption, OFS, usec = True):
         """
@@ -2268,20 +2892,37 @@ class Data107:
         The TVG function removed (from the datagram definition) is
         func_TVG = X * log(R) + 2 * Absorption * R + OFS + C
         Set the kwarg 'usec' to False to avoid applying the header c value.
+        The curves are kept in Data107.tvg_cache since the values they are
+        made from rarely change from ping to ping.
         """
-        x = self.header['TVGfunction']
+        self.ampdata -= Data107.tvg_curve(self.header, absorption, OFS, len(self.ampdata), usec)
+        self.hasTVG = False
+
+    @staticmethod
+    def tvg_curve(header, absorption, OFS, numsamples, usec = True):
+        """
+        Returns the TVG function described in deTVG for the header as a
+        (numsamples, 1) array.  Curves are kept in Data107.tvg_cache, and one
+        at least numsamples long is reused.
+        """
+        x = header['TVGfunction']
         if usec:
-            c = self.header['TVGoffset']
+            c = header['TVGoffset']
         else:
             c = 0
-        s = self.header['SoundSpeed']
-        dt = self.header['SamplingFrequency']
-        r = np.arange(len(self.ampdata)) * s / (2 * dt)
-        f = x * np.log10(r) + 2 * absorption * r / 1000. + OFS + c
-        f[0] = OFS + c
-        f.shape = (len(f), -1)
-        self.ampdata -= f
-        self.hasTVG = False
+        s = header['SoundSpeed']
+        dt = header['SamplingFrequency']
+        key = (x, c, s, dt, absorption, OFS)
+        f = Data107.tvg_cache.pop(key, None)
+        if f is None or len(f) < numsamples:
+            r = np.arange(numsamples) * s / (2 * dt)
+            f = x * np.log10(r) + 2 * absorption * r / 1000. + OFS + c
+            f[0] = OFS + c
+            f.shape = (len(f), -1)
+        Data107.tvg_cache[key] = f
+        if len(Data107.tvg_cache) > Data107.tvg_cache_size:
+            Data107.tvg_cache.popitem(last = False)
+        return f[:numsamples]
         
     def display(self):
         """
@@ -2460,20 +3101,19 @@ class useall(allRead):
     Built as a subclass of the allRead class to perform higher level functions.
     The file is mapped and the navigation array is built upon init.
     """
-    def __init__(self, infilename, reload_map = True, verbose = False, byteswap = False):
-        allRead.__init__(self,infilename,verbose,byteswap)
-        fname, ftype = infilename.rsplit('.')
-        if reload_map and os.path.exists(fname + '.par'):
+    def __init__(self, infilename, reload_map = True, verbose = False, byteswap = False, use_mmap = False):
+        allRead.__init__(self,infilename,verbose,byteswap,use_mmap)
+        if reload_map:
             self.loadfilemap()
-        else:
-            self.mapfile()
-            self.savefilemap()
-        
-        if reload_map and os.path.exists(fname + '.nav'):
+        if reload_map and self.mapped:
             self.load_navarray()
-        else:
+        if not self.mapped or not hasattr(self, 'navarray'):
+            self.mapfile()
             self._build_navarray(allrecords = True)
-            self.save_navarray()
+            self.save_index()
+        elif self._read_index() is None:
+            # the file has grown since the index was written
+            self.save_index()
         self._build_runtime_array()
         self.reset()
         
@@ -2594,10 +3234,9 @@ class useall(allRead):
             wcr = self.getwatercolumn(n)
             wc = np.zeros((numrec,wcr.header['Total#Beams']))
             for n in range(numrec):
-                wcr = self.getwatercolumn(n)
+                wcr = self.getwatercolumn(n, raw = True)
                 maxrange = wcr.rx['DetectedRange'].min()-2
-                ampdata = wcr.ampdata[:maxrange,:].astype(np.float64)
-                ampdata = 10**(ampdata/10.)
+                ampdata = wcr.getlinear()[:maxrange,:]
                 ampmean = ampdata.mean(axis = 0)
                 wc[n,:] = 10*np.log10(ampmean)
         else:
@@ -3059,17 +3698,20 @@ class useall(allRead):
         print "Getting sector and angle information:          ",
         k = which_swath
         progress = 0
+        rxtimes = np.zeros(bs.shape)
         for n in range(num78):
             ping78 = self.getrecord(78,k)
-            rxtimes = ping78.get_rx_time()
-            roll = self.getnav(rxtimes)[:,3] # in degrees
+            rxtimes[n,:] = ping78.get_rx_time()
             txid[n,:] = ping78.rx['TransmitSectorID']
-            beam_angle[n,:] = ping78.rx['BeamPointingAngle'] + roll + S2R
+            beam_angle[n,:] = ping78.rx['BeamPointingAngle']
             k += step
             temp = np.round((n * 100.)/num78)
             if  temp > progress:
                 progress = temp
                 print '\b\b\b\b\b\b\b\b\b\b\b%(percent)02d percent' %{'percent':progress},
+        # the roll for every beam of every ping in one call
+        roll = self.getnav(rxtimes.ravel())[:,3].reshape(rxtimes.shape) # in degrees
+        beam_angle = beam_angle + roll + S2R
         print '\n'
         print "Sorting backscatter by angle",
         angle_width = 1
@@ -3286,26 +3928,24 @@ class useall(allRead):
         if not self.map.packdir.has_key('80'):
             altfile = self.infilename[:-3] + 'all'
             if os.path.isfile(altfile):
-                b = allRead(altfile)
+                b = allRead(altfile, use_mmap = self.use_mmap)
                 b.mapfile()
             else:
                 print 'No Speed source found'
         else:
             altfile = ''
         if self.map.packdir.has_key('107'):
-            numwc = len(set(self.map.packdir['107'][:,3]))
-            for n in range(numwc):
-                subpack = self.getwatercolumn(n)
+            for packet in self.iterpings(raw = True):
+                subpack = packet.subpack
                 if len(altfile) == 0:
-                    speed = self.getspeed(self.packet.gettime())
+                    speed = self.getspeed(packet.gettime())
                 else:
-                    speed = b.getspeed(self.packet.gettime())
+                    speed = b.getspeed(packet.gettime())
                 if not np.isnan(speed):
                     speeds.append(speed)
                     if totalsamples == 0:
-                        totalsamples = subpack.ampdata.shape[0] - badsamples
-                    wc = subpack.ampdata[:totalsamples,:].astype(np.float64)
-                    wc = 10**(wc/10)
+                        totalsamples = subpack.rawamp.shape[0] - badsamples
+                    wc = subpack.getlinear()[:totalsamples,:]
                     noise.append(10 * np.log10(wc.mean(axis = 0)))
         if len(altfile) != 0:
             b.close()
@@ -3360,7 +4000,7 @@ class useall(allRead):
                 self.mapfile()
             numwc = len(set(self.map.packdir['107'][:,1]))
             for n in range(numwc):
-                ping = self.getwatercolumn(n)
+                ping = self.getwatercolumn(n, raw = True)
                 # get the ping header information
                 hdr['PingCounter'] = ping.header['PingCounter']
                 hdr['SystemSerialNum'] = ping.header['SystemSerial#']
@@ -3376,7 +4016,7 @@ class useall(allRead):
                 hdr['ScanningInfo'] = ping.header['ScanningInfo']
                 hdr.append()
                 # storing the wc in linear units
-                wc = 10**(ping.ampdata/20)
+                wc = ping.getlinear(power = False)
                 try:
                     name = 'ping' + str(ping.header['PingCounter'])
                     x = self.tblfile.createCArray(wc_group,name,tbl.Float32Atom(),wc.shape)
@@ -3388,7 +4028,7 @@ class useall(allRead):
                 extra['POSIXtime'] = t
                 extra['Speed'] = self.get_speed(t)
                 extra['PingInFile'] = n
-                x,y = ping.ampdata.shape
+                x,y = ping.rawamp.shape
                 extra['TotalSamples'] = x
                 extra['TotalBeams'] = y
                 extra['PingMean'] = wc.mean()
@@ -3494,6 +4134,38 @@ class mappack:
                 self.packdir[type].append([location, time, size, pingcounter])
             self.sizedir[type] = size
             
+    def extend(self, type, rows):
+        """
+        Adds an array of rows for the value type, each as location, time and
+        size (and ping counter for the watercolumn), sorted by time.  If the
+        new rows start before the end of the existing ones the whole type is
+        sorted again.
+        """
+        # a stable sort keeps the records that share a time stamp, such as the
+        # datagrams of one watercolumn ping, in the order they are in the file
+        rows = rows[rows[:,1].argsort(kind = 'mergesort')]
+        size = int(rows[:,2].sum())
+        if type in self.packdir and len(self.packdir[type]) > 0:
+            old = self.packdir[type]
+            rows = np.concatenate((old, rows))
+            if rows[len(old),1] < old[-1,1]:
+                rows = rows[rows[:,1].argsort(kind = 'mergesort')]
+            self.sizedir[type] += size
+        else:
+            self.sizedir[type] = size
+        self.packdir[type] = rows
+        
+    def getend(self):
+        """
+        Returns the byte location just past the last record in the map.
+        """
+        end = 0
+        for key in self.packdir.keys():
+            if len(self.packdir[key]) > 0:
+                last = (self.packdir[key][:,0] + self.packdir[key][:,2]).max()
+                end = max(end, int(last) + 4)
+        return end
+        
     def finalize(self):
         for key in self.packdir.keys():
             temp = np.asarray(self.packdir[key])
@@ -3568,9 +4240,8 @@ class resolve_file_depths:
         self.have_ssp_file = False
         self.have_patchtest = False
         self.p = allRead(primaryfile)
-        if os.path.isfile(primaryfile[:-3] + 'par'):
-            self.p.loadfilemap()
-        else:
+        self.p.loadfilemap()
+        if not self.p.mapped:
             self.p.mapfile()
             self.p.savefilemap()
         self.p._build_navarray()
@@ -4210,13 +4881,16 @@ def _build_extinction_curve(depths, across, binsize = 200):
         am.append( np.sum(avals * winvals) / winvals.sum() ) # window and normalize
     return depthstep, am
     
-def noise_from_passive_wc(path, speed_change_rate = 10, speed_bins = [], extension = 'wcd'):
+def noise_from_passive_wc(path, speed_change_rate = 10, speed_bins = [], extension = 'wcd', use_mmap = False, processes = 1):
     """
     Builds an array of noise data by averaging the watercolumn from the files
     at the provided path.  The kwarg speed_change_rate defines the number of
     pings that should be expected between speeds.  TVG is not removed from the
     water column backscatter because there is assumed to be no TVG in passive
-    mode.
+    mode.  The kwarg use_mmap is passed on to allRead for each file.
+    Each file is reduced to the speed and the noise by beam for each ping.  If
+    the kwarg processes is greater than one the files are reduced in a pool of
+    that many worker processes, or as many as there are cores if None.
     Get FFT by speed - commented out so as not to bog down the process.  This
     appears not to work properly.
     """
@@ -4229,42 +4903,36 @@ def noise_from_passive_wc(path, speed_change_rate = 10, speed_bins = [], extensi
     noise = []
 #    pingfft = []
     totalsamples = 0
-    for f in flist:
-        path, fname = os.path.split(f)
-        print 'Working on file ' + fname
-        a = allRead(f)
-        a.mapfile()
-        if not a.map.packdir.has_key('80'):
-            altfile = f[:-3] + 'all'
-            if os.path.isfile(altfile):
-                b = allRead(altfile)
-                b.mapfile()
-            else:
-                print 'No Speed source found for ' + fname
-                break
+    results = []
+    # the number of samples used for every ping is set by the first ping, so
+    # the files are worked through here until that is known.
+    n = 0
+    while n < len(flist) and totalsamples == 0:
+        result = _passive_wc_file((flist[n], badsamples, totalsamples, use_mmap))
+        results.append(result)
+        n += 1
+        if result is None:
+            break
+        totalsamples = result[2]
+    if (len(results) == 0 or results[-1] is not None) and n < len(flist):
+        args = [(f, badsamples, totalsamples, use_mmap) for f in flist[n:]]
+        if processes == 1:
+            for arg in args:
+                result = _passive_wc_file(arg)
+                results.append(result)
+                if result is None:
+                    break
         else:
-            altfile = ''
-        if a.map.packdir.has_key('107'):
-            numwc = len(set(a.map.packdir['107'][:,3]))
-            for n in range(numwc):
-                subpack = a.getwatercolumn(n)
-                if len(altfile) == 0:
-                    speed = a.getspeed(a.packet.gettime())
-                else:
-                    speed = b.getspeed(a.packet.gettime())
-                if not np.isnan(speed):
-                    speeds.append(speed)
-                    if totalsamples == 0:
-                        totalsamples = subpack.ampdata.shape[0] - badsamples
-                    wc = subpack.ampdata[:totalsamples,:].astype(np.float64)
-                    # wc_fft = np.fft.rfft(wc[:,100])#, axis = 0)
-                    wc = 10**(wc/10)
-                    noise.append(10 * np.log10(wc.mean(axis = 0)))
-                    # pingfft.append(wc_fft.real)#np.squeeze(wc_fft.mean(axis = 1).real))
-                
-        a.close()
-        if len(altfile) >0:
-            b.close()
+            pool = multiprocessing.Pool(processes)
+            results += pool.map(_passive_wc_file, args, chunksize = 1)
+            pool.close()
+            pool.join()
+    # a file without a speed source ends the list of files used
+    for result in results:
+        if result is None:
+            break
+        speeds += result[0]
+        noise += result[1]
 #    freq = np.fft.rfftfreq(wc.shape[0],1/subpack.header['SamplingFrequency'])
     # rearrange the data into arrays and by increasing speed
     noise = np.asarray(noise).T
@@ -4348,6 +5016,53 @@ def noise_from_passive_wc(path, speed_change_rate = 10, speed_bins = [], extensi
 #    plt.title('stuff')
 #    plt.grid()
         
+def _passive_wc_file(args):
+    """
+    Reduces one file for noise_from_passive_wc.  The argument is a tuple of
+    the file name, the number of bad samples at the end of each ping, the
+    number of samples to use (or 0 to take them from the first ping) and
+    whether to use mmap.  Returns the list of speeds, the list of noise by
+    beam for each ping and the number of samples used, or None if there is
+    no speed source for the file.
+    """
+    f, badsamples, totalsamples, use_mmap = args
+    speeds = []
+    noise = []
+    path, fname = os.path.split(f)
+    print 'Working on file ' + fname
+    a = allRead(f, use_mmap = use_mmap)
+    a.mapfile()
+    if not a.map.packdir.has_key('80'):
+        altfile = f[:-3] + 'all'
+        if os.path.isfile(altfile):
+            b = allRead(altfile, use_mmap = use_mmap)
+            b.mapfile()
+        else:
+            print 'No Speed source found for ' + fname
+            a.close()
+            return None
+    else:
+        altfile = ''
+    if a.map.packdir.has_key('107'):
+        for packet in a.iterpings(raw = True):
+            subpack = packet.subpack
+            if len(altfile) == 0:
+                speed = a.getspeed(packet.gettime())
+            else:
+                speed = b.getspeed(packet.gettime())
+            if not np.isnan(speed):
+                speeds.append(speed)
+                if totalsamples == 0:
+                    totalsamples = subpack.rawamp.shape[0] - badsamples
+                # wc_fft = np.fft.rfft(wc[:,100])#, axis = 0)
+                wc = subpack.getlinear()[:totalsamples,:]
+                noise.append(10 * np.log10(wc.mean(axis = 0)))
+                # pingfft.append(wc_fft.real)#np.squeeze(wc_fft.mean(axis = 1).real))
+    a.close()
+    if len(altfile) >0:
+        b.close()
+    return speeds, noise, totalsamples
+    
 def _find_speed_bins(speeds, speed_change_rate = 10, plotfig = False):
     """
     Takes an array of speeds and provides grouping assuming that the
@@ -4443,6 +5158,80 @@ def _assign_speed_bins(speeds, speed_bins, diff_from_bin = 0.5):
             used_speeds.append(sb)
     # find the indicies where accelerations were lower.
     return np.array(sb_idx), used_speeds
+    
+# seconds from the epoch to the start of the day, by YYYYMMDD date
+_posixday_cache = {}
+
+def posixtime(date, time, time_scale = 0.001):
+    """
+    Converts the Kongsberg header date (YYYYMMDD) and time fields to a POSIX
+    time stamp.  UTC is assumed.  The time field is multiplied by time_scale
+    to get seconds, and the default is for the milliseconds found in most
+    records.  The date and time can be single values or arrays, and arrays
+    are converted all at once.  The start of each day is cached for single
+    values since a file rarely spans more than a few days.
+    """
+    if np.ndim(date) == 0:
+        date = int(date)
+        if not _posixday_cache.has_key(date):
+            if len(_posixday_cache) > 64:
+                _posixday_cache.clear()
+            _posixday_cache[date] = _days_since_epoch(date) * 24 * 60 * 60
+        return _posixday_cache[date] + time * time_scale
+    else:
+        dates, dateidx = np.unique(np.asarray(date, dtype = np.int64), return_inverse = True)
+        daystart = _days_since_epoch(dates) * 24 * 60 * 60
+        return daystart[dateidx] + np.asarray(time) * time_scale
+        
+def _scale_field(header, name, scale):
+    """
+    Multiplies a field of a header, or of an array of headers, by scale.  The
+    product is taken in float64 and then stored in the field's own type so
+    that an array of float32 fields rounds the same way as a single header.
+    """
+    header[name] = np.asarray(header[name], dtype = np.float64) * scale
+
+def _replace_file(src, dst):
+    """
+    Renames src to dst, replacing dst if it exists, in one step so that a
+    reader sees either the old or the new file.  os.rename does this except
+    on Windows, where MoveFileEx is needed to replace a file.
+    """
+    if os.name == 'nt':
+        import ctypes
+        MOVEFILE_REPLACE_EXISTING = 0x1
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(src), unicode(dst),
+                MOVEFILE_REPLACE_EXISTING):
+            raise ctypes.WinError()
+    else:
+        os.rename(src, dst)
+
+# days in each month of a common year
+_month_days = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+def _days_since_epoch(date):
+    """
+    Returns the number of days from 1970-01-01 to the YYYYMMDD date using
+    integer arithmetic on the Gregorian calendar.  Works on integers or
+    integer arrays.  A ValueError is raised for impossible dates, as
+    datetime would.
+    """
+    year = date // 10000
+    month = date // 100 % 100
+    day = date % 100
+    if np.any((year < 1) | (year > 9999) | (month < 1) | (month > 12) | (day < 1)):
+        raise ValueError('Date ' + str(date) + ' is not a valid YYYYMMDD date')
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    monthdays = _month_days[month - 1] + (leap & (month == 2))
+    if np.any(day > monthdays):
+        raise ValueError('Date ' + str(date) + ' is not a valid YYYYMMDD date')
+    # count the year from March so the leap day falls at the end of the year
+    jan_feb = month <= 2
+    year = year - jan_feb
+    month = month + 12 * jan_feb - 3
+    dayofyear = (153 * month + 2) // 5 + day - 1
+    # 719468 is the day count for 1970-01-01 from the same origin
+    return 365 * year + year // 4 - year // 100 + year // 400 + dayofyear - 719468
        
 def main():        
     if len(sys.argv) > 1:
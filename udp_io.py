@@ -22,8 +22,11 @@ SOFTWARE.
 
 
 import socket
+import select
 import threading
 import struct
+import Queue
+import traceback
 from datetime import datetime
 
 
@@ -39,6 +42,24 @@ class udp_io(object):
         self.do_listen = False
         self.listening = False
 
+        # Receive controls.  The socket receive buffer is asked for rcvbuf_size
+        # bytes (the OS may give less) and up to batch_size datagrams that are
+        # already waiting are received before any are handled.
+        self.rcvbuf_size = 2**24
+        self.batch_size = 1
+
+        # Pipeline controls.  When threaded the listen thread only receives
+        # datagrams and queues them; a writer thread logs them and a parser
+        # thread parses them.  Each queue holds up to queue_size datagrams and
+        # when one is full queue_policy decides whether the listen thread waits
+        # ('block') or the oldest queued datagram is thrown away ('drop_oldest').
+        # A waiting listen thread gives up on the datagram when told to stop.
+        self.threaded = True
+        self.queue_size = 1024
+        self.queue_policy = 'block'
+        self.dropped = {'write': 0, 'parse': 0}
+        self.max_depth = {'write': 0, 'parse': 0}
+
         # Goodies for logging to memory
         self.logging_to_memory = False
         self.logged_data = []
@@ -128,7 +149,10 @@ class udp_io(object):
     def listen(self):
 
         self.sock_in = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock_in.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,2**16)
+        self.sock_in.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_size)
+        rcvbuf = self.sock_in.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if rcvbuf < self.rcvbuf_size:
+            print "Receive buffer is %d bytes rather than the %d asked for" % (rcvbuf, self.rcvbuf_size)
 
         if self.timeout > 0:
             self.sock_in.settimeout(self.timeout)
@@ -145,36 +169,167 @@ class udp_io(object):
         if self.debug:
             print "Going to listen on port", self.listen_port, "for datagrams ", self.desired_datagrams
 
+        if self.threaded:
+            self._queues = {'write': Queue.Queue(self.queue_size),
+                'parse': Queue.Queue(self.queue_size)}
+            self.dropped = {'write': 0, 'parse': 0}
+            self.max_depth = {'write': 0, 'parse': 0}
+            workers = {'write': threading.Thread(target=self.writer),
+                'parse': threading.Thread(target=self.parser)}
+            for worker in workers.values():
+                # so a stuck worker can never keep the program from exiting
+                worker.daemon = True
+                worker.start()
+
         self.do_listen = True
         self.listening = True
 
         while self.do_listen:
             try:
-                self.data, self.sender = self.sock_in.recvfrom( 2**16 )
+                batch = [self.receive()]
             except socket.timeout:
                 if self.debug:
                     print "Got socket timeout..."
                 continue
 
-            if self.debug:
-                print "Got data from", self.sender, "of length", len(self.data)
-                #print "Data is\n", self.data
+            while len(batch) < self.batch_size and select.select([self.sock_in], [], [], 0)[0]:
+                batch.append(self.receive())
 
-            if self.logging_to_file and self.logfile != None:
-                if self.debug:
-                    print "Going to write to output file", self.logfile_name, "length is", len(self.data), "bytes"
+            for data, sender in batch:
+                if self.threaded:
+                    item = (data, sender)
+                    if self.logging_to_file or self.logging_to_memory:
+                        self.enqueue('write', item)
+                    self.enqueue('parse', item)
+                else:
+                    self.data = data
+                    self.sender = sender
+                    self.handle_data()
 
-                self.log_to_file(self.data)
+        self.sock_in.close()
 
-            if self.logging_to_memory:
-                self.logged_data.append(self.data)
+        if self.threaded:
+            for name in self._queues:
+                # a full queue empties as long as its worker keeps going.  A
+                # worker that has stopped taking datagrams is left behind (it
+                # is a daemon thread) rather than hanging the shutdown.
+                q = self._queues[name]
+                depth = None
+                while workers[name].is_alive() and q.qsize() != depth:
+                    depth = q.qsize()
+                    try:
+                        q.put(None, timeout = 0.1)
+                        workers[name].join()
+                        break
+                    except Queue.Full:
+                        pass
 
-            self.parse()
+        if self.debug:
+            print "Done listening!", self
 
-        self.sock_in.close()
+    def receive(self):
+        """
+        Receives the next datagram and returns it as a string along with the
+        sender.  Each datagram gets its own string, so it can be queued or
+        kept as is.
+        """
+        return self.sock_in.recvfrom(2**16)
 
+    def handle_data(self):
+        """
+        Logs and parses the datagram in self.data.
+        """
         if self.debug:
-            print "Done listening!", self
+            print "Got data from", self.sender, "of length", len(self.data)
+            #print "Data is\n", self.data
+
+        if self.logging_to_file and self.logfile != None:
+            if self.debug:
+                print "Going to write to output file", self.logfile_name, "length is", len(self.data), "bytes"
+
+            self.log_to_file(self.data)
+
+        if self.logging_to_memory:
+            self.logged_data.append(self.data)
+
+        self.parse()
+
+    def enqueue(self, name, item):
+        """
+        Puts the item on the named queue following queue_policy and keeps
+        track of the drops and the deepest the queue has been.
+        """
+        q = self._queues[name]
+        if self.queue_policy == 'block':
+            while True:
+                try:
+                    q.put(item, timeout = 0.1)
+                    break
+                except Queue.Full:
+                    if not self.do_listen:
+                        self.dropped[name] += 1
+                        return
+        else:
+            while True:
+                try:
+                    q.put_nowait(item)
+                    break
+                except Queue.Full:
+                    try:
+                        q.get_nowait()
+                        self.dropped[name] += 1
+                    except Queue.Empty:
+                        pass
+        depth = q.qsize()
+        if depth > self.max_depth[name]:
+            self.max_depth[name] = depth
+
+    def queue_depth(self):
+        """
+        Returns a dictionary of the number of datagrams waiting in each queue.
+        """
+        if not self.__dict__.has_key('_queues'):
+            return {'write': 0, 'parse': 0}
+        return dict([(name, self._queues[name].qsize()) for name in self._queues])
+
+    def writer(self):
+        """
+        Logs queued datagrams to file and / or memory until given None.  A
+        datagram that cannot be logged is reported and skipped.
+        """
+        q = self._queues['write']
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            data, sender = item
+            try:
+                if self.logging_to_file and self.logfile != None:
+                    self.log_to_file(data)
+                if self.logging_to_memory:
+                    self.logged_data.append(data)
+            except:
+                print "Could not log datagram of length %d from %s" % (len(data), sender)
+                traceback.print_exc()
+
+    def parser(self):
+        """
+        Parses queued datagrams until given None.  This is the only thread
+        that sets self.data and self.sender while threaded.  A datagram that
+        cannot be parsed is reported and skipped.
+        """
+        q = self._queues['parse']
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            self.data, self.sender = item
+            try:
+                self.parse()
+            except:
+                # one bad datagram should not stop the parsing of the rest
+                print "Could not parse datagram of length %d from %s" % (len(self.data), self.sender)
+                traceback.print_exc()
 
     def stop_listen(self):
         self.do_listen = False